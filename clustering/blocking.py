@@ -0,0 +1,164 @@
+import random
+import itertools
+from collections import defaultdict
+from multiprocessing import current_process, get_context
+
+from confidence import missing
+from unionfind import UnionFind
+
+SAMPLE_SIZE = 50_000
+
+# Blocking attribute giving the decade of a year column. Rows whose year is
+# within `margin` years of a decade's border also belong to the neighboring
+# decade, so that close years are always found in a same block.
+class Decade(object):
+    def __init__(self, field, margin=0):
+        self.field = field
+        self.margin = margin
+
+    def blocks(self, value):
+        try:
+            year = int(value)
+        except ValueError:
+            return [None]
+
+        decade = year // 10 * 10
+        result = [decade]
+
+        if year - decade < self.margin:
+            result.append(decade - 10)
+
+        if decade + 10 - year <= self.margin:
+            result.append(decade + 10)
+
+        return result
+
+# Blocking attribute giving the value of a column as is, e.g. citizenship
+class Value(object):
+    def __init__(self, field):
+        self.field = field
+
+    def blocks(self, value):
+        return [value]
+
+# NOTE: set in the forked workers' memory by Blocking.run
+BLOCKS = []
+
+def run_block(task):
+    method, b = task
+
+    return [list(cluster) for cluster in method(BLOCKS[b])]
+
+def merge_clusters(uf, results):
+    for clusters in results:
+        for cluster in clusters:
+            for row in cluster[1:]:
+                uf.union(cluster[0], row)
+
+# Partition of the rows by the values of some attributes, a row belonging to
+# one block per combination of the blocks of its attributes. Rows missing an
+# attribute are gathered in a block of their own, keyed by None.
+class Blocking(object):
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def assign(self, data, rows):
+        blocks = defaultdict(list)
+
+        # Computing the blocks of each distinct value only once
+        columns = []
+
+        for attribute in self.attributes:
+            column = data.columns[attribute.field]
+
+            values = [
+                [None] if missing(value) else attribute.blocks(value)
+                for value in column.categories
+            ]
+
+            columns.append((column.array(), values + [[None]]))
+
+        for row in rows:
+            for key in itertools.product(*(values[codes[row]] for codes, values in columns)):
+                blocks[key].append(row)
+
+        return blocks
+
+    # Function running the given clustering method on every block in
+    # parallel, then merging the clusters found, which overlap when rows
+    # belong to several blocks, as connected components ordered by their
+    # first row. The method is given each block as a sorted list of rows.
+    def run(self, method, data, rows, processes=None):
+        blocks = sorted(self.assign(data, rows).values(), key=len, reverse=True)
+
+        BLOCKS[:] = blocks
+
+        uf = UnionFind(len(data))
+
+        tasks = ((method, b) for b in range(len(BLOCKS)))
+
+        try:
+
+            # NOTE: pool workers, e.g. when running methods concurrently, cannot have children
+            if processes != 1 and current_process().daemon:
+                print('Warning: blocks running on a single process, since pool workers cannot have children')
+
+            if processes == 1 or current_process().daemon:
+                merge_clusters(uf, map(run_block, tasks))
+            else:
+                with get_context('fork').Pool(processes) as pool:
+                    merge_clusters(uf, pool.imap_unordered(run_block, tasks))
+        finally:
+            BLOCKS.clear()
+
+        return uf.components()
+
+    # Function counting, on a sample of rows, the pairs of rows clustered
+    # together by the method, how many of them are lost when blocking, i.e.
+    # when they never share a block, and how many pairs are gained, i.e. only
+    # clustered together when merging the clusters of overlapping blocks
+    def recall(self, method, data, processes=None, sample_size=SAMPLE_SIZE, seed=0):
+        rng = random.Random(seed)
+        sample = sorted(rng.sample(range(len(data)), min(sample_size, len(data))))
+
+        blocked = {}
+
+        for c, cluster in enumerate(self.run(method, data, sample, processes)):
+            for row in cluster:
+                blocked[row] = c
+
+        pairs = 0
+        lost = 0
+
+        clustered = {}
+        blocked_clusters = defaultdict(list)
+
+        for row, c in blocked.items():
+            blocked_clusters[c].append(row)
+
+        for m, cluster in enumerate(method(sample)):
+            cluster = list(cluster)
+            pairs += len(cluster) * (len(cluster) - 1) // 2
+
+            counts = defaultdict(int)
+
+            for row in cluster:
+                clustered[row] = m
+
+                if row in blocked:
+                    counts[blocked[row]] += 1
+
+            lost += len(cluster) * (len(cluster) - 1) // 2 - sum(n * (n - 1) // 2 for n in counts.values())
+
+        gained = 0
+
+        for cluster in blocked_clusters.values():
+            counts = defaultdict(int)
+
+            for row in cluster:
+                if row in clustered:
+                    counts[clustered[row]] += 1
+
+            gained += len(cluster) * (len(cluster) - 1) // 2 - sum(n * (n - 1) // 2 for n in counts.values())
+
+        return pairs, lost, gained
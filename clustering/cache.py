@@ -0,0 +1,47 @@
+import sqlite3
+
+BATCH_SIZE = 500
+
+# On-disk cache of the keys computed by each method, stored in a sqlite
+# database, one table per method, mapping an input string to its key.
+# A method's table is emptied as soon as its version changes.
+class KeyCache(object):
+    def __init__(self, path, versions):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS versions (method TEXT PRIMARY KEY, version TEXT)')
+
+        known = dict(self.connection.execute('SELECT method, version FROM versions'))
+
+        for method, version in versions.items():
+            table = self.table(method)
+
+            if known.get(method) != version:
+                self.connection.execute('DROP TABLE IF EXISTS %s' % table)
+                self.connection.execute('INSERT OR REPLACE INTO versions VALUES (?, ?)', (method, version))
+
+            self.connection.execute('CREATE TABLE IF NOT EXISTS %s (input TEXT PRIMARY KEY, key TEXT) WITHOUT ROWID' % table)
+
+        self.connection.commit()
+
+    def table(self, method):
+        return '"keys_%s"' % method
+
+    # Function returning a dict of the cached keys of the given inputs
+    def get(self, method, inputs):
+        table = self.table(method)
+        found = {}
+
+        for i in range(0, len(inputs), BATCH_SIZE):
+            batch = inputs[i:i + BATCH_SIZE]
+            query = 'SELECT input, key FROM %s WHERE input IN (%s)' % (table, ','.join('?' * len(batch)))
+
+            found.update(self.connection.execute(query, batch))
+
+        return found
+
+    def set(self, method, items):
+        self.connection.executemany('INSERT OR REPLACE INTO %s VALUES (?, ?)' % self.table(method), items)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
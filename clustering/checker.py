@@ -6,10 +6,13 @@ CLUSTERS = defaultdict(list)
 
 with open('./tocheck.csv') as f:
     for line in csv.DictReader(f):
-        cluster_method = line['valid_cluster']
-        cluster_id = line[cluster_method]
+        cluster_id = line['valid_cluster']
 
-        CLUSTERS[(cluster_method, cluster_id)].append(line)
+        # NOTE: rows outside of any accepted cluster have an empty id
+        if not cluster_id:
+            continue
+
+        CLUSTERS[cluster_id].append(line)
 
 def get_ranking(row):
     ranking = row['ranking_final_B_5']
@@ -34,5 +37,6 @@ for cluster in top:
             row['name'],
             row['ranking_final_B_5'],
             row['valid_cluster'],
-            row['%s_confidence' % row['valid_cluster']]
+            row['valid_cluster_methods'],
+            '|'.join(row['%s_confidence' % method] for method in row['valid_cluster_methods'].split('|'))
         )
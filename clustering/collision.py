@@ -0,0 +1,134 @@
+import os
+import heapq
+import pickle
+import tempfile
+import itertools
+from collections import defaultdict
+from operator import itemgetter
+
+MEMORY_BUDGET = 1024 ** 3
+BATCH_SIZE = 10_000
+FAN_IN = 256
+
+# NOTE: rough size of a record besides its key, i.e. a tuple & two integers
+RECORD_SIZE = 120
+
+# Function reading back a sorted run, written as successive pickled batches
+def read_run(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+
+            yield from batch
+
+# Records sorted out of core: records are buffered until their estimated size
+# exceeds the memory budget, then sorted and spilled to a temporary file, the
+# sorted runs being merged back when iterating
+class ExternalSorter(object):
+    def __init__(self, directory, memory=MEMORY_BUDGET):
+        self.directory = directory
+        self.memory = memory
+        self.buffer = []
+        self.size = 0
+        self.runs = []
+
+    def add(self, record, size):
+        self.buffer.append(record)
+        self.size += size
+
+        if self.size >= self.memory:
+            self.spill()
+
+    def write_run(self, records):
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix='.run')
+
+        with os.fdopen(fd, 'wb') as f:
+            batch = []
+
+            for record in records:
+                batch.append(record)
+
+                if len(batch) >= BATCH_SIZE:
+                    pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    batch = []
+
+            if batch:
+                pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        return path
+
+    def spill(self):
+        self.buffer.sort()
+        self.runs.append(self.write_run(self.buffer))
+
+        self.buffer = []
+        self.size = 0
+
+        # Merging runs beforehand, so as not to open too many files at once
+        if len(self.runs) >= FAN_IN:
+            runs = self.runs
+            self.runs = [self.write_run(heapq.merge(*(read_run(path) for path in runs)))]
+
+            for path in runs:
+                os.remove(path)
+
+    def __iter__(self):
+        self.buffer.sort()
+
+        return heapq.merge(self.buffer, *(read_run(path) for path in self.runs))
+
+# Out-of-core version of fog's key_collision, with the same clusters in the
+# same order, i.e. by first item: (key, position, item) records are sorted
+# externally, so that items sharing a key are contiguous, then clusters are
+# sorted externally by the position of their first item. Memory is thus
+# bounded by the budget, but for the clusters themselves. When every record
+# fits in the budget, items are simply grouped in memory.
+#
+# NOTE: falsey keys are dropped, as in fog
+def key_collision(data, key, min_size=2, max_size=float('inf'), memory=MEMORY_BUDGET, tmp_dir=None):
+    with tempfile.TemporaryDirectory(prefix='key-collision-', dir=tmp_dir) as directory:
+        records = ExternalSorter(directory, memory)
+
+        for position, item in enumerate(data):
+            k = key(item)
+
+            if k:
+                records.add((k, position, item), len(k) + RECORD_SIZE)
+
+        if not records.runs:
+            buckets = defaultdict(list)
+
+            for k, _, item in records.buffer:
+                buckets[k].append(item)
+
+            for cluster in buckets.values():
+                if min_size <= len(cluster) <= max_size:
+                    yield cluster
+
+            return
+
+        clusters = ExternalSorter(directory, memory)
+
+        for _, group in itertools.groupby(records, key=itemgetter(0)):
+            first = None
+            size = 0
+            cluster = []
+
+            for _, position, item in group:
+                if first is None:
+                    first = position
+
+                # NOTE: items of clusters too large are only counted
+                size += 1
+
+                if size <= max_size:
+                    cluster.append(item)
+
+            if min_size <= size <= max_size:
+                clusters.add((first, cluster), RECORD_SIZE * (len(cluster) + 1))
+
+        for _, cluster in clusters:
+            yield cluster
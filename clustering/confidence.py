@@ -0,0 +1,142 @@
+import numpy as np
+
+CONFIDENCE_FIELDS = [
+    'gender_B',
+    'birth_B',
+    'death_B',
+    'final_occupation_L2_B',
+    'final_citizenship'
+]
+
+def missing(value):
+    return not value or value == 'Other' or value == '.' or value == 'missing'
+
+CONFIDENCE_TOTAL = 4.0
+def confidence_score(cluster, boosted=False):
+    score = 0
+
+    genders = set(r['gender_B'] for r in cluster)
+    genders_without_missing = set(r['gender_B'] for r in cluster if not missing(r['gender_B']))
+
+    births = set(r['birth_B'] for r in cluster)
+    births_without_missing = set(r['birth_B'] for r in cluster if not missing(r['birth_B']))
+
+    deaths = set(r['death_B'] for r in cluster)
+    deaths_without_missing = set(r['death_B'] for r in cluster if not missing(r['death_B']))
+
+    occupations = set(r['final_occupation_L2_B'] for r in cluster)
+    occupations_without_missing = set(r['final_occupation_L2_B'] for r in cluster if not missing(r['final_occupation_L2_B']))
+
+    citizenships = set(r['final_citizenship'] for r in cluster)
+    citizenships_without_missing = set(r['final_citizenship'] for r in cluster if not missing(r['final_citizenship']))
+
+    if (
+        len(genders_without_missing) > 1 or
+        len(births_without_missing) > 1 or
+        len(deaths_without_missing) > 1
+    ):
+        return 0
+
+    score += 1 - len([r['gender_B'] for r in cluster if missing(r['gender_B'])]) / len(cluster)
+    score += 1 - len([r['birth_B'] for r in cluster if missing(r['birth_B'])]) / len(cluster)
+    score += 1 - len([r['death_B'] for r in cluster if missing(r['death_B'])]) / len(cluster)
+
+    if boosted and score == 0:
+        score = 0.5
+
+    if len(occupations_without_missing) < 2:
+        score += 0.5 - len([r['final_occupation_L2_B'] for r in cluster if missing(r['final_occupation_L2_B'])]) / len(cluster) / 2.0
+
+    if len(citizenships_without_missing) < 2:
+        score += 0.5 - len([r['final_citizenship'] for r in cluster if missing(r['final_citizenship'])]) / len(cluster) / 2.0
+
+    normalized = score / CONFIDENCE_TOTAL
+
+    if (
+        normalized == 0.75 and
+        not any(missing(r['birth_B']) for r in cluster) and
+        len(occupations) < 2 and
+        len(citizenships) < 2
+    ):
+        normalized += 0.05
+
+    return normalized
+
+# Batch version of confidence_score, scoring every cluster of a method at once
+# using grouped numpy operations over the codes of the store's columns.
+# Results are identical to confidence_score's.
+class ConfidenceScorer(object):
+    def __init__(self, data):
+        self.codes = {}
+        self.missing = {}
+
+        for field in CONFIDENCE_FIELDS:
+            column = data.columns[field]
+
+            # NOTE: code -1 stands for a missing value, hence the shift
+            self.codes[field] = column.array() + 1
+            self.missing[field] = np.array([True] + [missing(v) for v in column.categories], dtype=bool)
+
+    # Function taking a (cluster_id, row_id) array, cluster ids going from 0
+    # to n - 1, and returning the confidence of the n clusters
+    def scores(self, assignments, boosted=False):
+        assignments = np.asarray(assignments, dtype=np.int64).reshape(-1, 2)
+        clusters = assignments[:, 0]
+        rows = assignments[:, 1]
+
+        n = int(clusters.max()) + 1 if len(clusters) else 0
+        sizes = np.bincount(clusters, minlength=n).astype(np.float64)
+
+        missing_counts = {}
+        distinct = {}
+        distinct_without_missing = {}
+
+        for field in CONFIDENCE_FIELDS:
+            codes = self.codes[field][rows]
+            is_missing = self.missing[field][codes]
+
+            missing_counts[field] = np.bincount(clusters[is_missing], minlength=n).astype(np.float64)
+
+            # Counting distinct (cluster, value) couples
+            couples = np.unique(clusters * (len(self.missing[field]) + 1) + codes)
+            distinct[field] = np.bincount(couples // (len(self.missing[field]) + 1), minlength=n)
+
+            couples = np.unique(clusters[~is_missing] * (len(self.missing[field]) + 1) + codes[~is_missing])
+            distinct_without_missing[field] = np.bincount(couples // (len(self.missing[field]) + 1), minlength=n)
+
+        # NOTE: operations are done in the same order as confidence_score, so
+        # that floating point results are the same
+        score = np.zeros(n, dtype=np.float64)
+        score += 1 - missing_counts['gender_B'] / sizes
+        score += 1 - missing_counts['birth_B'] / sizes
+        score += 1 - missing_counts['death_B'] / sizes
+
+        if boosted:
+            score[score == 0] = 0.5
+
+        mask = distinct_without_missing['final_occupation_L2_B'] < 2
+        score[mask] += 0.5 - missing_counts['final_occupation_L2_B'][mask] / sizes[mask] / 2.0
+
+        mask = distinct_without_missing['final_citizenship'] < 2
+        score[mask] += 0.5 - missing_counts['final_citizenship'][mask] / sizes[mask] / 2.0
+
+        normalized = score / CONFIDENCE_TOTAL
+
+        bonus = (
+            (normalized == 0.75) &
+            (missing_counts['birth_B'] == 0) &
+            (distinct['final_occupation_L2_B'] < 2) &
+            (distinct['final_citizenship'] < 2)
+        )
+
+        normalized[bonus] += 0.05
+
+        conflicting = (
+            (distinct_without_missing['gender_B'] > 1) |
+            (distinct_without_missing['birth_B'] > 1) |
+            (distinct_without_missing['death_B'] > 1)
+        )
+
+        normalized[conflicting] = 0
+
+        return normalized
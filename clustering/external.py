@@ -0,0 +1,323 @@
+import os
+import re
+import csv
+import sys
+import json
+import shutil
+import itertools
+import numpy as np
+from ast import literal_eval
+from array import array
+from tqdm import tqdm
+from collections import defaultdict
+from operator import itemgetter
+
+from unionfind import UnionFind
+
+CODE_RE = re.compile(r'^Q(\d+)$')
+TUPLE_RE = re.compile(r"""(?<=['"]\)),\s""")
+
+# Function parsing the external identifiers of a row, given as a list of
+# tuple literals such as "('P214', 'VIAF ID', '12345'), ('P227', ...)",
+# into (property, identifier) tuples
+def parse_tuples(string):
+
+    if not string.strip():
+        return
+
+    try:
+        entries = literal_eval('[%s]' % string)
+    except (ValueError, SyntaxError):
+
+        # Falling back to parsing tuples one by one, skipping invalid ones
+        entries = []
+
+        for entry in TUPLE_RE.split(string):
+            try:
+                entries.append(literal_eval(entry))
+            except (ValueError, SyntaxError):
+                continue
+
+    for t in entries:
+        if isinstance(t, tuple) and len(t) > 2:
+            yield t[0], t[2]
+
+# Strings interned as consecutive ids, then written as a single utf-8 buffer
+# along with the offsets of each string
+class StringTable(object):
+    def __init__(self):
+        self.index = {}
+        self.buffer = bytearray()
+        self.offsets = array('Q', [0])
+
+    def intern(self, string):
+        i = self.index.get(string)
+
+        if i is None:
+            i = len(self.index)
+            self.index[string] = i
+            self.buffer += string.encode('utf-8')
+            self.offsets.append(len(self.buffer))
+
+        return i
+
+    def save(self, path, name):
+        np.save(os.path.join(path, name + '.npy'), np.frombuffer(self.buffer, dtype=np.uint8))
+        np.save(os.path.join(path, name + '_offsets.npy'), np.frombuffer(self.offsets, dtype=np.uint64))
+
+def load_strings(path, name):
+    buffer = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+    offsets = np.load(os.path.join(path, name + '_offsets.npy'), mmap_mode='r')
+
+    return buffer, offsets
+
+def get_index_path(file_path):
+    return os.path.splitext(file_path)[0] + '.index'
+
+# Function returning the size & modification time of the source file, stored
+# in the index so that it is rebuilt whenever the source changes
+def get_source_stats(file_path):
+    stats = os.stat(file_path)
+
+    return {'size': stats.st_size, 'mtime_ns': stats.st_mtime_ns}
+
+def is_index_stale(file_path, index_path):
+    try:
+        with open(os.path.join(index_path, 'source.json')) as f:
+            return json.load(f) != get_source_stats(file_path)
+    except (OSError, ValueError):
+        return True
+
+# Function converting the external sources file into a binary index: a
+# directory of arrays, sorted by numerical wikidata code, where the
+# (property, identifier) pairs of the code found at position i are found
+# between offsets[i] and offsets[i + 1]. Properties & identifiers are stored
+# as ids of interned strings, so that equal pairs have equal ids.
+def build_index(file_path, index_path=None):
+    if index_path is None:
+        index_path = get_index_path(file_path)
+
+    codes = array('Q')
+    properties = array('I')
+    identifiers = array('I')
+
+    property_strings = StringTable()
+    identifier_strings = StringTable()
+
+    skipped = 0
+
+    with open(file_path) as f:
+        reader = csv.reader(f)
+        next(reader)
+
+        for row in tqdm(reader, desc='Indexing external sources'):
+            match = CODE_RE.match(row[0])
+
+            if match is None:
+                skipped += 1
+                continue
+
+            code = int(match.group(1))
+
+            for key, identifier in parse_tuples(row[2]):
+                codes.append(code)
+                properties.append(property_strings.intern(key))
+                identifiers.append(identifier_strings.intern(str(identifier)))
+
+    # Sorting pairs by code, keeping the file order of a same code's pairs
+    codes = np.frombuffer(codes, dtype=np.uint64)
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+
+    unique_codes, starts = np.unique(codes, return_index=True)
+    offsets = np.append(starts, len(codes)).astype(np.uint64)
+
+    tmp_path = index_path + '.tmp'
+    os.makedirs(tmp_path, exist_ok=True)
+
+    np.save(os.path.join(tmp_path, 'codes.npy'), unique_codes)
+    np.save(os.path.join(tmp_path, 'offsets.npy'), offsets)
+    np.save(os.path.join(tmp_path, 'properties.npy'), np.frombuffer(properties, dtype=np.uint32)[order])
+    np.save(os.path.join(tmp_path, 'identifiers.npy'), np.frombuffer(identifiers, dtype=np.uint32)[order])
+
+    property_strings.save(tmp_path, 'property_strings')
+    identifier_strings.save(tmp_path, 'identifier_strings')
+
+    with open(os.path.join(tmp_path, 'source.json'), 'w') as f:
+        json.dump(get_source_stats(file_path), f)
+
+    if os.path.exists(index_path):
+        shutil.rmtree(index_path)
+
+    os.replace(tmp_path, index_path)
+
+    print('Indexed %i pairs for %i codes (%i rows skipped)' % (len(codes), len(unique_codes), skipped))
+
+# Read-only access to the index, whose arrays are memory-mapped so that it
+# loads instantly and is shared by every process reading it
+class ExternalIndex(object):
+    def __init__(self, index_path):
+        load = lambda name: np.load(os.path.join(index_path, name + '.npy'), mmap_mode='r')
+
+        self.codes = load('codes')
+        self.offsets = load('offsets')
+        self.properties = load('properties')
+        self.identifiers = load('identifiers')
+
+        self.property_strings = load_strings(index_path, 'property_strings')
+        self.identifier_strings = load_strings(index_path, 'identifier_strings')
+
+    @classmethod
+    def open(cls, file_path):
+        index_path = get_index_path(file_path)
+
+        if is_index_stale(file_path, index_path):
+            build_index(file_path, index_path)
+
+        return cls(index_path)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def find(self, code):
+        match = CODE_RE.match(code) if code else None
+
+        if match is None:
+            return None
+
+        n = int(match.group(1))
+        i = int(np.searchsorted(self.codes, n))
+
+        if i < len(self.codes) and self.codes[i] == n:
+            return i
+
+        return None
+
+    def __contains__(self, code):
+        return self.find(code) is not None
+
+    # Function returning the (property, identifier) pairs of a code, as ids
+    def get(self, code, default=None):
+        i = self.find(code)
+
+        if i is None:
+            return default
+
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+
+        return list(zip(self.properties[start:end].tolist(), self.identifiers[start:end].tolist()))
+
+    def string(self, strings, i):
+        buffer, offsets = strings
+
+        return bytes(buffer[offsets[i]:offsets[i + 1]]).decode('utf-8')
+
+    # Function returning the (property, identifier) pairs of a code, as strings
+    def get_strings(self, code, default=None):
+        pairs = self.get(code)
+
+        if pairs is None:
+            return default
+
+        return [
+            (self.string(self.property_strings, p), self.string(self.identifier_strings, i))
+            for p, i in pairs
+        ]
+
+# Function returning the profile of a code, i.e. its identifiers by property
+def get_profile(index, position):
+    start, end = int(index.offsets[position]), int(index.offsets[position + 1])
+    profile = defaultdict(set)
+
+    for p, i in zip(index.properties[start:end].tolist(), index.identifiers[start:end].tolist()):
+        profile[p].add(i)
+
+    return {p: frozenset(identifiers) for p, identifiers in profile.items()}
+
+# Function clustering rows sharing at least one (property, identifier) pair,
+# given a column of their wikidata codes. Rows are found through an inverted
+# index of the pairs, and merged using a union-find. Two components are only
+# merged if they agree on every property they have in common, i.e. if they
+# have the exact same identifiers for it, so that components of any size are
+# consistent.
+def cluster_external_identifiers(codes, index):
+    uf = UnionFind(len(codes))
+
+    # Position of each row's code in the index
+    positions = [index.find(code) for code in codes.categories]
+    positions = np.array([-1 if p is None else p for p in positions], dtype=np.int64)
+
+    row_codes = codes.array()
+    rows = np.flatnonzero(row_codes >= 0)
+
+    if len(positions) == 0 or len(rows) == 0:
+        return []
+
+    row_positions = positions[row_codes[rows]]
+    rows = rows[row_positions >= 0]
+    row_positions = row_positions[row_positions >= 0]
+
+    # Listing every (row, pair) association
+    starts = index.offsets[row_positions].astype(np.int64)
+    counts = index.offsets[row_positions + 1].astype(np.int64) - starts
+
+    pair_rows = np.repeat(rows, counts)
+    pairs = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+
+    keys = (index.properties[pairs].astype(np.uint64) << np.uint64(32)) | index.identifiers[pairs].astype(np.uint64)
+
+    # Sorting by pair, so that rows sharing a pair are contiguous
+    order = np.lexsort((pair_rows, keys))
+    keys = keys[order].tolist()
+    pair_rows = pair_rows[order].tolist()
+
+    row_position = dict(zip(rows.tolist(), row_positions.tolist()))
+    profiles = {}
+
+    def profile(root):
+        p = profiles.get(root)
+
+        if p is None:
+            p = get_profile(index, row_position[root])
+            profiles[root] = p
+
+        return p
+
+    # Merging two components if they agree, returning the resulting root
+    def merge(a, b):
+        A = profile(a)
+        B = profile(b)
+
+        if any(A[p] != B[p] for p in A.keys() & B.keys()):
+            return a
+
+        merged = dict(A)
+        merged.update(B)
+
+        root = uf.union(a, b)
+        profiles[root] = merged
+        profiles.pop(a if root == b else b, None)
+
+        return root
+
+    # Each row sharing a pair is tried against every component already found
+    # for this pair, and not only the previous row's, since the latter may
+    # conflict with rows that would agree with each other
+    for _, group in itertools.groupby(zip(keys, pair_rows), key=itemgetter(0)):
+        roots = []
+
+        for _, row in group:
+            a = uf.find(row)
+
+            for b in roots:
+                b = uf.find(b)
+
+                if a != b:
+                    a = merge(a, b)
+
+            roots = list(dict.fromkeys([uf.find(b) for b in roots] + [a]))
+
+    return uf.components()
+
+if __name__ == '__main__':
+    build_index(sys.argv[1])
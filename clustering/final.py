@@ -1,207 +1,172 @@
-import re
+import os
 import csv
 import codecs
 import itertools
+import multiprocessing
+import numpy as np
 from tqdm import tqdm
 from collections import defaultdict
-from unidecode import unidecode
-from fog.clustering import passjoin, key_collision, sorted_neighborhood
 from fog.metrics import overlap_coefficient
-from fog.phonetics import cologne, rusalka
-from fog.utils import squeeze
-from fog.key import fingerprint, ngrams_fingerprint
 from statistics import mean, median, stdev
-from Levenshtein import distance as levenshtein
+
+from blocking import Blocking, Decade, Value
+from cache import KeyCache
+from collision import key_collision
+from confidence import ConfidenceScorer
+from external import ExternalIndex, cluster_external_identifiers
+from incremental import save_state
+from keys import compute_keys, get_versions, tokenize
+from minhash import minhash_lsh
+from passjoin import passjoin
+from snm import sort_order, sorted_neighborhood
+from store import ColumnStore
+from unionfind import UnionFind
 
 INPUT = './final-with-ranking.csv'
 WIKIDATA_EXTERNAL_SOURCES = './wikidata_external_sources.csv'
 OUTPUT = './final-clustering.csv'
 
-TEST_RUN = False
-TEST_RUN_BATCH = 1_000_000
-
-FIELDNAMES_TO_ADD = [
-    'transliteration',
-    'normalized_transliteration',
-    'valid_cluster'
-]
-
-NUMBER_RE = re.compile(r'(?:^[.,XVI0-9\-]+$|[()])', re.I)
-NON_LATIN_RE = re.compile(r'[^0-9A-Za-z\u00C0-\u00D6\u00D8-\u00f6\u00f8-\u00ff\s]', re.I)
-
-def process(name):
-    return name.lower().strip()
+# NOTE: set to None to disable the cache
+KEYS_CACHE = './keys-cache.sqlite'
 
-def process_harsher(name):
-    return squeeze(process(name), keep_roman_numerals=True).replace('-', '').replace('_', '')
+# NOTE: state used by incremental.py, set to None to skip saving it
+STATE = './final-clustering.state.sqlite'
 
-def safe_cologne(name):
-    try:
-        return cologne(name)
-    except:
-        return None
-
-def has_non_latin_characters(name):
-    return bool(NON_LATIN_RE.search(name))
-
-def tokenize(name):
-    name = name.replace('-', '_').lower()
-    return name.split('_')
-
-def initialize(name):
-    tokens = tokenize(name)
-
-    if any(NUMBER_RE.match(t) for t in tokens):
-        return name
-
-    if len(tokens) < 2:
-        return name
-
-    try:
-        initials = '_'.join(s[0] + '.' for s in tokens[:-1])
-    except:
-        return name
-
-    return initials + tokens[-1]
-
-def missing(value):
-    return not value or value == 'Other' or value == '.' or value == 'missing'
+TEST_RUN = False
+TEST_RUN_BATCH = 1_000_000
 
-CONFIDENCE_TOTAL = 4.0
-def confidence_score(cluster, boosted=False):
-    score = 0
+PROCESSES = os.cpu_count()
 
-    genders = set(r['gender_B'] for r in cluster)
-    genders_without_missing = set(r['gender_B'] for r in cluster if not missing(r['gender_B']))
+# NOTE: number of methods run at once, set to 1 to run them one after another
+METHOD_PROCESSES = PROCESSES
 
-    births = set(r['birth_B'] for r in cluster)
-    births_without_missing = set(r['birth_B'] for r in cluster if not missing(r['birth_B']))
+# NOTE: memory budget of each key collision, whose keys are spilled to sorted
+# temporary files beyond it, see collision.py
+KEY_COLLISION_MEMORY = 1024 ** 3
 
-    deaths = set(r['death_B'] for r in cluster)
-    deaths_without_missing = set(r['death_B'] for r in cluster if not missing(r['death_B']))
+# NOTE: set to None to run every method on the whole dataset at once, e.g.
+# Blocking([Decade('birth_B', margin=2), Value('final_citizenship')]), see blocking.py
+BLOCKING = None
 
-    occupations = set(r['final_occupation_L2_B'] for r in cluster)
-    occupations_without_missing = set(r['final_occupation_L2_B'] for r in cluster if not missing(r['final_occupation_L2_B']))
+# NOTE: number of rows sampled to report the recall lost by blocking, 0 to skip it
+BLOCKING_REPORT_SAMPLE = 50_000
 
-    citizenships = set(r['final_citizenship'] for r in cluster)
-    citizenships_without_missing = set(r['final_citizenship'] for r in cluster if not missing(r['final_citizenship']))
+FIELDNAMES_TO_ADD = [
+    'transliteration',
+    'normalized_transliteration',
+    'valid_cluster',
+    'valid_cluster_methods'
+]
 
-    if (
-        len(genders_without_missing) > 1 or
-        len(births_without_missing) > 1 or
-        len(deaths_without_missing) > 1
-    ):
-        return 0
+# NOTE: external sources are read from a binary index, built on first run, see external.py
+EXTERNAL = ExternalIndex.open(WIKIDATA_EXTERNAL_SOURCES)
 
-    score += 1 - len([r['gender_B'] for r in cluster if missing(r['gender_B'])]) / len(cluster)
-    score += 1 - len([r['birth_B'] for r in cluster if missing(r['birth_B'])]) / len(cluster)
-    score += 1 - len([r['death_B'] for r in cluster if missing(r['death_B'])]) / len(cluster)
+# Reading data
+with codecs.open(INPUT, encoding='utf-8', errors='replace') as f:
+    reader = csv.DictReader(f)
+    fieldnames = reader.fieldnames
 
-    if boosted and score == 0:
-        score = 0.5
+    # NOTE: rows are stored column-wise, see store.py
+    DATA = ColumnStore(fieldnames)
 
-    if len(occupations_without_missing) < 2:
-        score += 0.5 - len([r['final_occupation_L2_B'] for r in cluster if missing(r['final_occupation_L2_B'])]) / len(cluster) / 2.0
+    if TEST_RUN:
+        reader = itertools.islice(reader, 0, TEST_RUN_BATCH)
 
-    if len(citizenships_without_missing) < 2:
-        score += 0.5 - len([r['final_citizenship'] for r in cluster if missing(r['final_citizenship'])]) / len(cluster) / 2.0
+    for line in tqdm(reader, desc='Reading data'):
+        DATA.append(line)
 
-    normalized = score / CONFIDENCE_TOTAL
+    DATA.freeze()
 
-    if (
-        normalized == 0.75 and
-        not any(missing(r['birth_B']) for r in cluster) and
-        len(occupations) < 2 and
-        len(citizenships) < 2
-    ):
-        normalized += 0.05
+NAMES = DATA.columns['name']
 
-    return normalized
+# Computing transliterations & every clustering key beforehand, in parallel
+print('Computing keys for %i distinct names' % len(NAMES.categories))
 
-EXTERNAL = defaultdict(list)
-DATA = []
+cache = KeyCache(KEYS_CACHE, get_versions()) if KEYS_CACHE else None
+KEYS = compute_keys(NAMES, processes=PROCESSES, cache=cache)
 
-TUPLE_RE = re.compile(r"""(?<=['"]\)),\s""")
+if cache is not None:
+    cache.close()
 
-def parse_tuples(string):
+DATA.add_column('transliteration', KEYS['transliteration'])
+DATA.add_column('normalized_transliteration', KEYS['normalized_transliteration'])
 
-    if not string.strip():
-        return
+TRANSLITERATIONS = KEYS['transliteration']
 
-    for entry in TUPLE_RE.split(string):
-        t = eval(entry)
-        yield t[0], t[2]
+# Accepted clusters, along with the methods that found them
+VALID_CLUSTERS = {}
+METHODS = []
 
-# Aggregating external sources
-with open(WIKIDATA_EXTERNAL_SOURCES) as f:
-    reader = csv.reader(f)
-    next(reader)
+SCORER = ConfidenceScorer(DATA)
 
-    if TEST_RUN:
-        reader = itertools.islice(reader, 0, TEST_RUN_BATCH)
+# Function running a clustering method, in a worker, and returning compact
+# arrays: the rows of its clusters along with their cluster id, as well as
+# the confidence of each cluster
+def run_clustering(task):
+    method, options = task
 
-    for row in tqdm(reader, desc='Reading external sources'):
-        wikidata_code = row[0]
+    blocked = BLOCKING is not None and options.get('blockable', True)
 
-        for key, identifier in parse_tuples(row[2]):
-            EXTERNAL[wikidata_code].append((key, identifier))
+    if blocked:
+        found = BLOCKING.run(method, DATA, range(len(DATA)), processes=PROCESSES)
+    else:
+        found = list(method(range(len(DATA))))
 
-# Reading data
-with codecs.open(INPUT, encoding='utf-8', errors='replace') as f:
-    reader = csv.DictReader(f)
-    fieldnames = reader.fieldnames
-    buckets = defaultdict(list)
+    # Scoring every cluster at once, from a flat (cluster_id, row_id) array
+    assignments = np.empty((sum(len(cluster) for cluster in found), 2), dtype=np.int64)
+    offset = 0
 
-    if TEST_RUN:
-        reader = itertools.islice(reader, 0, TEST_RUN_BATCH)
+    for c, cluster in enumerate(found):
+        assignments[offset:offset + len(cluster), 0] = c
+        assignments[offset:offset + len(cluster), 1] = cluster
+        offset += len(cluster)
 
-    for line in tqdm(reader, desc='Processing data'):
-        line['normalized_transliteration'] = unidecode(line['name'])
+    if options.get('unambiguous', False):
+        C = np.ones(len(found), dtype=np.float64)
+    else:
+        C = SCORER.scores(assignments)
 
-        if has_non_latin_characters(line['name']):
-            line['transliteration'] = line['normalized_transliteration']
-        else:
-            line['transliteration'] = line['name']
+    recall = None
 
-        DATA.append(line)
+    if blocked and BLOCKING_REPORT_SAMPLE:
+        recall = BLOCKING.recall(method, DATA, processes=PROCESSES, sample_size=BLOCKING_REPORT_SAMPLE)
 
-VALID_CLUSTERS = {}
+    return assignments[:, 1].astype(np.int32), assignments[:, 0].astype(np.int32), C, recall
 
-def apply_clustering(method, data, aggresive=False, unambiguous=False):
+def apply_clustering(method, result, aggresive=False, unambiguous=False, blockable=True, parallel=False):
     name = method.__name__
+    METHODS.append(name)
 
     threshold = 0.75 if not aggresive else 0.8
 
     FIELDNAMES_TO_ADD.append(name)
     FIELDNAMES_TO_ADD.append(name + '_confidence')
 
-    I = 0
-    n = 0
-    C = []
-    V = 0
+    clusters = DATA.add_array(name, np.int32, -1)
+    confidences = DATA.add_array(name + '_confidence', np.float32, np.nan)
 
-    for c, cluster in enumerate(method(range(len(DATA)))):
-        items = [DATA[i] for i in cluster]
-        I += len(items)
-        n += 1
+    rows, cluster_ids, C, recall = result
 
-        if unambiguous:
-            confidence = 1
-        else:
-            confidence = confidence_score(items)
+    # NOTE: rows are grouped by cluster, in order
+    found = np.split(rows, np.cumsum(np.bincount(cluster_ids, minlength=len(C)))[:-1]) if len(C) else []
+    C = C.tolist()
 
-        C.append(confidence)
+    I = len(rows)
+    n = len(found)
+    V = 0
 
+    for c, (cluster, confidence) in enumerate(zip(found, C)):
         if confidence >= threshold:
-            key = tuple(sorted(cluster))
+            key = tuple(sorted(cluster.tolist()))
 
             if key not in VALID_CLUSTERS:
-                VALID_CLUSTERS[key] = name
+                VALID_CLUSTERS[key] = []
                 V += 1
 
-        for item in items:
-            item[name] = c
-            item[name + '_confidence'] = confidence
+            VALID_CLUSTERS[key].append(name)
+
+    clusters[rows] = cluster_ids
+    confidences[rows] = np.array(C)[cluster_ids]
 
     non_zero_C = [c for c in C if c > 0]
     non_zero_mean = mean(non_zero_C)
@@ -224,81 +189,43 @@ def apply_clustering(method, data, aggresive=False, unambiguous=False):
     print('  rows: %i *%i' % (I, len(non_zero_C)))
     print('  confidence avg: %2f *%2f' % (mean(C), non_zero_mean))
     print('  confidence median: %2f *%2f' % (median(C), non_zero_median))
-    print()
-
-# 0a
-def clustering_0a_external_identifiers(data):
-
-    default_list = []
-
-    def keys(i):
-        code = DATA[i].get('wikidata_code')
-
-        if code is None:
-            return
-
-        return EXTERNAL.get(code, default_list)
-
-    for cluster in key_collision(data, keys=keys, max_size=2):
-
-        # TODO: remove when fog is fixed
-        if len(cluster) > 2:
-            continue
-
-        codeA = DATA[cluster[0]].get('wikidata_code')
-        codeB = DATA[cluster[1]].get('wikidata_code')
-
-        # We want perfect overlap
-        A = EXTERNAL.get(codeA, set()) if codeA else set()
-        B = EXTERNAL.get(codeB, set()) if codeB else set()
 
-        # NOTE: we could rely on key intersection match
-        # if overlap_coefficient(A, B) != 1:
-        #     continue
+    if recall is not None:
+        pairs, lost, gained = recall
+        print('  pairs lost by blocking: %i/%i sampled pairs (%2f)' % (lost, pairs, lost / pairs if pairs else 0))
+        print('  pairs gained by blocking: %i' % gained)
 
-        Ak = set(s for s, _ in A)
-        Bk = set(s for s, _ in B)
-
-        Ik = Ak & Bk
-
-        assert len(Ik) > 0
-
-        Ai = set(p for p in A if p[0] in Ik)
-        Bi = set(p for p in B if p[0] in Ik)
+    print()
 
-        # print()
-        if Ai != Bi:
-        #     print('DISCARD')
-        #     print(A)
-        #     print(B)
-        #     print(Ik)
-        #     print(DATA[cluster[0]]['name'], '=>', DATA[cluster[1]]['name'])
-            continue
+# Function returning the distinct strings of a column among the given rows,
+# along with the index of the string of each row, -1 meaning no string
+def restrict(column, rows):
+    codes = column.array()[rows].astype(np.int64)
+    present = codes >= 0
 
-        # print('KEEP')
-        # print(A)
-        # print(B)
-        # print(Ik)
-        # print(DATA[cluster[0]]['name'], '=>', DATA[cluster[1]]['name'])
+    used, codes[present] = np.unique(codes[present], return_inverse=True)
 
-        yield cluster
+    return [column.categories[c] for c in used.tolist()], codes
 
+# 0a
+def clustering_0a_external_identifiers(data):
+    return cluster_external_identifiers(DATA.columns['wikidata_code'], EXTERNAL)
 
 # 0b Exact
 def clustering_0b_exact(data):
-    return key_collision(data, key=lambda i: DATA[i]['name'])
+    return key_collision(data, key=lambda i: NAMES[i], memory=KEY_COLLISION_MEMORY)
 
 # 1. Basic normalization
 def clustering_1_normalization(data):
-    return key_collision(data, key=lambda i: process(DATA[i]['transliteration']))
+    return key_collision(data, key=lambda i: KEYS['normalization'][i], memory=KEY_COLLISION_MEMORY)
 
 # 2. Harsher normalization
 def clustering_2_harsh_normalization(data):
-    return key_collision(data, key=lambda i: process_harsher(DATA[i]['transliteration']))
+    return key_collision(data, key=lambda i: KEYS['harsh_normalization'][i], memory=KEY_COLLISION_MEMORY)
 
 # 3. Initials normalization
 def clustering_3_initials(data):
-    for cluster in key_collision(data, key=lambda i: initialize(DATA[i]['transliteration']), max_size=2):
+    for cluster in key_collision(data, key=lambda i: KEYS['initials'][i], max_size=2, memory=KEY_COLLISION_MEMORY):
 
         # We check the cluster once more:
         # If no item in the cluster has initials, we filter it
@@ -310,67 +237,156 @@ def clustering_3_initials(data):
 
 # 4. Fingerprinting
 def clustering_4_fingerprinting(data):
-    return key_collision(data, key=lambda i: fingerprint(DATA[i]['transliteration']))
+    return key_collision(data, key=lambda i: KEYS['fingerprint'][i], memory=KEY_COLLISION_MEMORY)
 
 # 5. Bigram fingerprinting
 def clustering_5_bigram_fingerprinting(data):
-    return key_collision(data, key=lambda i: ngrams_fingerprint(2, DATA[i]['transliteration']))
+    return key_collision(data, key=lambda i: KEYS['bigram_fingerprint'][i], memory=KEY_COLLISION_MEMORY)
 
 # 6. Cologne
 def clustering_6_cologne(data):
-    return key_collision(data, key=lambda i: safe_cologne(DATA[i]['transliteration']))
+    return key_collision(data, key=lambda i: KEYS['cologne'][i], memory=KEY_COLLISION_MEMORY)
 
 # 7. Rusalka
 def clustering_7_rusalka(data):
-    return key_collision(data, key=lambda i: rusalka(DATA[i]['transliteration']))
+    return key_collision(data, key=lambda i: KEYS['rusalka'][i], memory=KEY_COLLISION_MEMORY)
 
 # 8. SNM k=1
 def clustering_8_snm(data):
+    rows = np.asarray(data, dtype=np.int64)
+    strings, codes = restrict(TRANSLITERATIONS, rows)
+
+    # NOTE: rows without transliteration are given the empty string
+    strings.append('')
+    codes[codes < 0] = len(strings) - 1
+
+    zig_zag = (sort_order(strings, codes), sort_order(strings, codes, key=lambda s: s[::-1]))
+
+    for cluster in sorted_neighborhood(strings, codes, zig_zag, radius=1, window=20):
+        yield rows[cluster].tolist()
+
+# 9. Pass-join k=1
+def clustering_9_passjoin(data):
+    rows = np.asarray(data, dtype=np.int64)
+    strings, codes = restrict(TRANSLITERATIONS, rows)
+
+    # NOTE: when blocking, blocks are already joined in parallel
+    processes = 1 if BLOCKING is not None else PROCESSES
+
+    for cluster in passjoin(strings, codes, k=1, processes=processes):
+        yield rows[cluster].tolist()
+
+# 10. MinHash LSH
+def clustering_10_minhash(data):
+    rows = np.asarray(data, dtype=np.int64)
+    strings, codes = restrict(KEYS['normalization'], rows)
+
+    # NOTE: tokens are sorted so that reordered names share their n-grams
+    strings = [' '.join(sorted(t for t in tokenize(s) if t)) for s in strings]
+
+    for cluster in minhash_lsh(strings, codes, bands=8, permutations=32, threshold=0.6):
+        yield rows[cluster].tolist()
+
+# Clustering methods, in order of priority, along with their options
+# NOTE: methods running their own pool of processes are flagged as parallel
+# NOTE: methods capping the size of their clusters are never blocked, since
+# the cap cannot hold once the clusters of overlapping blocks are merged
+CLUSTERINGS = [
+    (clustering_0a_external_identifiers, {'blockable': False}),
+    (clustering_0b_exact, {}),
+    (clustering_1_normalization, {}),
+    (clustering_2_harsh_normalization, {}),
+    (clustering_3_initials, {'aggresive': True, 'blockable': False}),
+    (clustering_4_fingerprinting, {'aggresive': True}),
+    (clustering_5_bigram_fingerprinting, {'aggresive': True}),
+    (clustering_6_cologne, {'aggresive': True}),
+    (clustering_7_rusalka, {'aggresive': True}),
+    (clustering_8_snm, {'aggresive': True}),
+    (clustering_9_passjoin, {'aggresive': True, 'parallel': True}),
+    (clustering_10_minhash, {'aggresive': True})
+]
+
+# Function returning whether a method runs in a pool of its own, i.e. when it
+# is flagged as parallel or when it is blocked
+def parallelizes(options):
+    return options.get('parallel', False) or (BLOCKING is not None and options.get('blockable', True))
+
+# Running every method concurrently, in workers forked once the data is
+# loaded so that they share it, then applying their clusters in order
+# NOTE: pool workers cannot have children, so methods parallelizing
+# themselves are run afterwards, one after another, in the main process
+RESULTS = [None] * len(CLUSTERINGS)
+CONCURRENT = [i for i, (_, options) in enumerate(CLUSTERINGS) if not parallelizes(options)]
 
-    distance = lambda i, j: levenshtein(DATA[i]['transliteration'], DATA[j]['transliteration'])
+if METHOD_PROCESSES > 1 and CONCURRENT:
+    context = multiprocessing.get_context('fork')
 
-    zig_zag = (lambda i: DATA[i]['transliteration'], lambda i: DATA[i]['transliteration'][::-1])
+    with context.Pool(min(METHOD_PROCESSES, len(CONCURRENT))) as pool:
+        results = pool.map(run_clustering, [CLUSTERINGS[i] for i in CONCURRENT], chunksize=1)
 
-    return sorted_neighborhood(data, radius=1, window=20, distance=distance, keys=zig_zag)
+    for i, result in zip(CONCURRENT, results):
+        RESULTS[i] = result
 
-# Applying clusterings
-apply_clustering(clustering_0a_external_identifiers, DATA)
-apply_clustering(clustering_0b_exact, DATA)
-apply_clustering(clustering_1_normalization, DATA)
-apply_clustering(clustering_2_harsh_normalization, DATA)
-apply_clustering(clustering_3_initials, DATA, aggresive=True)
-apply_clustering(clustering_4_fingerprinting, DATA, aggresive=True)
-apply_clustering(clustering_5_bigram_fingerprinting, DATA, aggresive=True)
-apply_clustering(clustering_6_cologne, DATA, aggresive=True)
-apply_clustering(clustering_7_rusalka, DATA, aggresive=True)
-apply_clustering(clustering_8_snm, DATA, aggresive=True)
+for i, task in enumerate(CLUSTERINGS):
+    if RESULTS[i] is None:
+        RESULTS[i] = run_clustering(task)
+
+for (method, options), result in zip(CLUSTERINGS, RESULTS):
+    apply_clustering(method, result, **options)
+
+# Consolidating accepted clusters from every method into connected components
+uf = UnionFind(len(DATA))
+
+for key in VALID_CLUSTERS:
+    for i in key[1:]:
+        uf.union(key[0], i)
+
+CONTRIBUTIONS = defaultdict(set)
+
+for key, methods in VALID_CLUSTERS.items():
+    CONTRIBUTIONS[uf.find(key[0])].update(methods)
+
+COMPONENTS = uf.components()
+
+# NOTE: components are numbered by their first row, so that ids are stable
+valid_clusters = DATA.add_array('valid_cluster', np.int32, -1)
+valid_cluster_methods = DATA.add_column('valid_cluster_methods')
 
-ROWS_TO_MERGE = set()
 RANKINGS = []
 
-for key, method in VALID_CLUSTERS.items():
-    ROWS_TO_MERGE.update(key)
+for c, component in enumerate(COMPONENTS):
+    methods = CONTRIBUTIONS[uf.find(component[0])]
+    methods = '|'.join(m for m in METHODS if m in methods)
 
-    for i in key:
-        DATA[i]['valid_cluster'] = method
+    valid_clusters[component] = c
+
+    for i in component:
+        valid_cluster_methods[i] = methods
         ranking = DATA[i]['ranking_final_B_5']
 
         if ranking:
             ranking = float(ranking)
             RANKINGS.append(ranking)
-        # print(DATA[i]['name'], DATA[i]['gender_B'], DATA[i]['birth_B'], DATA[i]['death_B'], DATA[i]['final_occupation_L2_B'], DATA[i]['final_citizenship'], DATA[i][method + '_confidence'], method)
+        # print(DATA[i]['name'], DATA[i]['gender_B'], DATA[i]['birth_B'], DATA[i]['death_B'], DATA[i]['final_occupation_L2_B'], DATA[i]['final_citizenship'], methods)
 
     # print()
 
-print('Found a total of %i valid clusters gathering %i rows' % (len(VALID_CLUSTERS), len(ROWS_TO_MERGE)))
+print('Found a total of %i valid clusters, consolidated into %i clusters gathering %i rows' % (
+    len(VALID_CLUSTERS),
+    len(COMPONENTS),
+    sum(len(component) for component in COMPONENTS)
+))
 print('  Median ranking: %2f' % median(RANKINGS))
 print('  Mean ranking: %2f' % mean(RANKINGS))
 print('  Stdev ranking: %2f' % stdev(RANKINGS))
 print('  Min ranking: %2f' % min(RANKINGS))
 
 with open(OUTPUT, 'w') as of:
-    writer = csv.DictWriter(of, fieldnames=fieldnames + FIELDNAMES_TO_ADD)
-    writer.writeheader()
+    writer = csv.writer(of)
+    writer.writerow(fieldnames + FIELDNAMES_TO_ADD)
+
+    for row in tqdm(DATA.rows(fieldnames + FIELDNAMES_TO_ADD), desc='Writing ouput', total=len(DATA)):
+        writer.writerow(row)
 
-    for item in tqdm(DATA, desc='Writing ouput'):
-        writer.writerow(item)
+if STATE:
+    save_state(STATE, DATA, KEYS, VALID_CLUSTERS, METHODS)
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# Incremental deduplication
+#
+# Updating the clusters found by final.py from a delta file, a csv file with
+# the same columns as final.py's input along with an "op" column, being one
+# of "add", "remove" or "change", and a "row" column, being the id of the
+# removed or changed row, i.e. its position in final.py's input (added rows
+# are given new ids).
+#
+# final.py saves its state, i.e. the rows, the keys of every key-based method
+# and the accepted clusters of every method, so that only the keys & clusters
+# affected by the delta have to be recomputed.
+#
+# NOTE: methods 0a (external identifiers), 8 (SNM), 9 (pass-join) & 10
+# (MinHash) are not key-based and cannot be updated incrementally: their
+# clusters involving changed or removed rows are dropped, and added rows are
+# not matched by them until the next full run.
+#
+import os
+import csv
+import sqlite3
+from collections import defaultdict
+from tqdm import tqdm
+
+from confidence import CONFIDENCE_FIELDS, confidence_score
+from keys import FUNCTIONS, KEY_FUNCTIONS, transliterate
+from unionfind import UnionFind
+
+STATE = './final-clustering.state.sqlite'
+OUTPUT = './final-clustering-delta.csv'
+
+ROW_FIELDS = ['name'] + CONFIDENCE_FIELDS
+
+# Key, maximum cluster size & confidence threshold of the key-based methods
+# NOTE: must be kept in sync with final.py
+KEY_METHODS = {
+    'clustering_0b_exact': ('name', float('inf'), 0.75),
+    'clustering_1_normalization': ('normalization', float('inf'), 0.75),
+    'clustering_2_harsh_normalization': ('harsh_normalization', float('inf'), 0.75),
+    'clustering_3_initials': ('initials', 2, 0.8),
+    'clustering_4_fingerprinting': ('fingerprint', float('inf'), 0.8),
+    'clustering_5_bigram_fingerprinting': ('bigram_fingerprint', float('inf'), 0.8),
+    'clustering_6_cologne': ('cologne', float('inf'), 0.8),
+    'clustering_7_rusalka': ('rusalka', float('inf'), 0.8)
+}
+
+SCHEMA = [
+    'CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE rows (id INTEGER PRIMARY KEY AUTOINCREMENT, %s)' % ', '.join('%s TEXT' % f for f in ROW_FIELDS),
+    'CREATE TABLE keys (method TEXT, key TEXT, row INTEGER)',
+    'CREATE TABLE valid (method TEXT, cluster TEXT, row INTEGER)',
+    'CREATE TABLE components (row INTEGER PRIMARY KEY, component INTEGER, methods TEXT)'
+]
+
+INDICES = [
+    'CREATE INDEX keys_by_key ON keys (method, key)',
+    'CREATE INDEX keys_by_row ON keys (row)',
+    'CREATE INDEX valid_by_cluster ON valid (method, cluster)',
+    'CREATE INDEX valid_by_row ON valid (row)',
+    'CREATE INDEX components_by_component ON components (component)'
+]
+
+# Function returning the key of every key-based method for a single name
+def get_row_keys(name):
+    transliteration = transliterate(name)
+
+    keys = {'name': name}
+
+    for key, _, _ in KEY_FUNCTIONS:
+        keys[key] = FUNCTIONS[key](transliteration)
+
+    return {method: keys[key] for method, (key, _, _) in KEY_METHODS.items()}
+
+# Function saving the state of a full run of final.py, given its column store,
+# its key columns, its accepted clusters along with the methods having found
+# them, and the ordered list of every method
+def save_state(path, data, keys, valid_clusters, methods):
+    if os.path.exists(path):
+        os.remove(path)
+
+    db = sqlite3.connect(path)
+
+    for statement in SCHEMA:
+        db.execute(statement)
+
+    db.execute('INSERT INTO meta VALUES (?, ?)', ('methods', '|'.join(methods)))
+
+    columns = [data.columns[f] for f in ROW_FIELDS]
+
+    db.executemany(
+        'INSERT INTO rows VALUES (?, %s)' % ', '.join('?' * len(ROW_FIELDS)),
+        ([i] + [column[i] for column in columns] for i in range(len(data)))
+    )
+
+    for method, (key, _, _) in tqdm(KEY_METHODS.items(), desc='Saving keys'):
+        column = data.columns['name'] if key == 'name' else keys[key]
+
+        db.executemany(
+            'INSERT INTO keys VALUES (?, ?, ?)',
+            ((method, column[i], i) for i in range(len(data)) if column[i])
+        )
+
+    # NOTE: clusters of key-based methods are identified by their key
+    for cluster, cluster_methods in valid_clusters.items():
+        for method in cluster_methods:
+            if method in KEY_METHODS:
+                key = KEY_METHODS[method][0]
+                column = data.columns['name'] if key == 'name' else keys[key]
+                cluster_id = column[cluster[0]]
+            else:
+                cluster_id = str(cluster[0])
+
+            db.executemany('INSERT INTO valid VALUES (?, ?, ?)', ((method, cluster_id, i) for i in cluster))
+
+    valid_cluster = data.columns['valid_cluster']
+    valid_cluster_methods = data.columns['valid_cluster_methods']
+
+    db.executemany(
+        'INSERT INTO components VALUES (?, ?, ?)',
+        ((i, int(valid_cluster[i]), valid_cluster_methods[i]) for i in range(len(data)) if valid_cluster[i] >= 0)
+    )
+
+    for statement in INDICES:
+        db.execute(statement)
+
+    db.commit()
+    db.close()
+
+class IncrementalState(object):
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+
+        self.methods = self.db.execute('SELECT value FROM meta WHERE name = ?', ('methods',)).fetchone()[0].split('|')
+
+    def column(self, query, *args):
+        return [r[0] for r in self.db.execute(query, args)]
+
+    def cluster_rows(self, method, cluster):
+        return self.column('SELECT row FROM valid WHERE method = ? AND cluster = ?', method, cluster)
+
+    def component_rows(self, row):
+        return self.column(
+            'SELECT row FROM components WHERE component = (SELECT component FROM components WHERE row = ?)',
+            row
+        )
+
+    # Function dropping every cluster a row belongs to, returning their rows
+    def drop_clusters(self, row):
+        rows = set()
+
+        for method, cluster in self.db.execute('SELECT DISTINCT method, cluster FROM valid WHERE row = ?', (row,)).fetchall():
+            rows.update(self.cluster_rows(method, cluster))
+            self.db.execute('DELETE FROM valid WHERE method = ? AND cluster = ?', (method, cluster))
+
+        return rows
+
+    def drop_keys(self, row):
+        keys = set(tuple(r) for r in self.db.execute('SELECT method, key FROM keys WHERE row = ?', (row,)))
+        self.db.execute('DELETE FROM keys WHERE row = ?', (row,))
+
+        return keys
+
+    def add_keys(self, row, name):
+        keys = set()
+
+        for method, key in get_row_keys(name).items():
+            if key:
+                self.db.execute('INSERT INTO keys VALUES (?, ?, ?)', (method, key, row))
+                keys.add((method, key))
+
+        return keys
+
+    # Function clustering the rows sharing a key once more, returning the rows
+    # of the cluster if it is accepted
+    def recluster(self, method, key):
+        _, max_size, threshold = KEY_METHODS[method]
+
+        rows = self.column('SELECT row FROM keys WHERE method = ? AND key = ?', method, key)
+
+        if len(rows) < 2 or len(rows) > max_size:
+            return []
+
+        records = self.db.execute(
+            'SELECT * FROM rows WHERE id IN (%s)' % ','.join('?' * len(rows)),
+            rows
+        ).fetchall()
+
+        if confidence_score(records) < threshold:
+            return []
+
+        self.db.executemany('INSERT INTO valid VALUES (?, ?, ?)', ((method, key, row) for row in rows))
+
+        return rows
+
+    # Function recomputing the components of the given rows. Components are
+    # extended to every row they are connected to through accepted clusters,
+    # and keep the id of one of their former components whenever possible.
+    def update_components(self, rows):
+        seen = set()
+        clusters = {}
+        stack = list(rows)
+
+        while stack:
+            row = stack.pop()
+
+            if row in seen:
+                continue
+
+            seen.add(row)
+            stack.extend(self.component_rows(row))
+
+            for method, cluster in self.db.execute('SELECT DISTINCT method, cluster FROM valid WHERE row = ?', (row,)).fetchall():
+                if (method, cluster) not in clusters:
+                    clusters[(method, cluster)] = self.cluster_rows(method, cluster)
+                    stack.extend(clusters[(method, cluster)])
+
+        ids = sorted(seen)
+        positions = {row: p for p, row in enumerate(ids)}
+        uf = UnionFind(len(ids))
+
+        for cluster_rows in clusters.values():
+            for row in cluster_rows[1:]:
+                uf.union(positions[cluster_rows[0]], positions[row])
+
+        contributions = defaultdict(set)
+
+        for (method, _), cluster_rows in clusters.items():
+            contributions[uf.find(positions[cluster_rows[0]])].add(method)
+
+        former = {}
+
+        for row in ids:
+            r = self.db.execute('SELECT component FROM components WHERE row = ?', (row,)).fetchone()
+
+            if r is not None:
+                former[row] = r[0]
+
+        self.db.executemany('DELETE FROM components WHERE row = ?', ((row,) for row in ids))
+
+        next_id = self.db.execute('SELECT MAX(component) FROM components').fetchone()[0]
+        next_id = (next_id if next_id is not None else -1) + 1
+        next_id = max([next_id] + [c + 1 for c in former.values()])
+
+        reused = set()
+        result = {}
+
+        for component in uf.components():
+            candidates = sorted(former[p] for p in (ids[i] for i in component) if p in former and former[p] not in reused)
+
+            if candidates:
+                component_id = candidates[0]
+                reused.add(component_id)
+            else:
+                component_id = next_id
+                next_id += 1
+
+            methods = contributions[uf.find(component[0])]
+            methods = '|'.join(m for m in self.methods if m in methods)
+
+            for i in component:
+                result[ids[i]] = (component_id, methods)
+                self.db.execute('INSERT INTO components VALUES (?, ?, ?)', (ids[i], component_id, methods))
+
+        return {row: result.get(row, ('', '')) for row in ids}
+
+    def apply(self, delta):
+        affected_keys = set()
+        touched = set()
+        ops = {}
+        names = {}
+
+        for line in tqdm(delta, desc='Applying delta'):
+            op = line['op']
+
+            if op == 'add':
+                values = [line.get(f) or '' for f in ROW_FIELDS]
+                cursor = self.db.execute(
+                    'INSERT INTO rows (%s) VALUES (%s)' % (', '.join(ROW_FIELDS), ', '.join('?' * len(ROW_FIELDS))),
+                    values
+                )
+                row = cursor.lastrowid
+
+            elif op in ('remove', 'change'):
+                row = int(line['row'])
+
+                affected_keys.update(self.drop_keys(row))
+                touched.update(self.drop_clusters(row))
+
+                if op == 'remove':
+                    self.db.execute('DELETE FROM rows WHERE id = ?', (row,))
+                else:
+                    self.db.execute(
+                        'UPDATE rows SET %s WHERE id = ?' % ', '.join('%s = ?' % f for f in ROW_FIELDS),
+                        [line.get(f) or '' for f in ROW_FIELDS] + [row]
+                    )
+
+            else:
+                raise ValueError('Unknown delta op: %s' % op)
+
+            ops[row] = op
+            names[row] = line.get('name') or ''
+            touched.add(row)
+
+            if op != 'remove':
+                affected_keys.update(self.add_keys(row, line.get('name') or ''))
+
+        # Reclustering every affected key
+        for method, key in tqdm(affected_keys, desc='Reclustering keys'):
+            touched.update(self.cluster_rows(method, key))
+            self.db.execute('DELETE FROM valid WHERE method = ? AND cluster = ?', (method, key))
+            touched.update(self.recluster(method, key))
+
+        components = self.update_components(touched)
+
+        for row in components:
+            if row not in names:
+                r = self.db.execute('SELECT name FROM rows WHERE id = ?', (row,)).fetchone()
+                names[row] = r[0] if r is not None else ''
+
+        # Removed rows must not belong to any component anymore
+        for row, op in ops.items():
+            if op == 'remove':
+                self.db.execute('DELETE FROM components WHERE row = ?', (row,))
+                components[row] = ('', '')
+
+        self.db.commit()
+
+        return ops, names, components
+
+    def close(self):
+        self.db.close()
+
+# Function applying a delta file to the saved state, and writing the rows
+# whose cluster may have changed
+def update(delta_path, state_path=STATE, output_path=OUTPUT):
+    state = IncrementalState(state_path)
+
+    with open(delta_path) as f:
+        ops, names, components = state.apply(csv.DictReader(f))
+
+    with open(output_path, 'w') as of:
+        writer = csv.writer(of)
+        writer.writerow(['row', 'op', 'name', 'valid_cluster', 'valid_cluster_methods'])
+
+        for row in sorted(components):
+            component_id, methods = components[row]
+            writer.writerow([row, ops.get(row, ''), names.get(row, ''), component_id, methods])
+
+    print('Updated %i rows, %i rows written to %s' % (len(ops), len(components), output_path))
+
+    state.close()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('delta', help='Path to the delta file.')
+    parser.add_argument('--state', default=STATE, help='Path to the state saved by final.py. Defaults to %(default)s.')
+    parser.add_argument('-o', '--output', default=OUTPUT, help='Path to the output file. Defaults to %(default)s.')
+    args = parser.parse_args()
+
+    update(args.delta, args.state, args.output)
@@ -0,0 +1,174 @@
+import re
+import itertools
+import numpy as np
+import multiprocessing
+from array import array
+from importlib import metadata
+from functools import partial
+from unidecode import unidecode
+from fog.phonetics import cologne, rusalka
+from fog.utils import squeeze
+from fog.key import fingerprint, ngrams_fingerprint
+
+from store import Column
+
+CHUNK_SIZE = 10_000
+
+NUMBER_RE = re.compile(r'(?:^[.,XVI0-9\-]+$|[()])', re.I)
+NON_LATIN_RE = re.compile(r'[^0-9A-Za-z\u00C0-\u00D6\u00D8-\u00f6\u00f8-\u00ff\s]', re.I)
+
+def process(name):
+    return name.lower().strip()
+
+def process_harsher(name):
+    return squeeze(process(name), keep_roman_numerals=True).replace('-', '').replace('_', '')
+
+def safe_cologne(name):
+    try:
+        return cologne(name)
+    except:
+        return None
+
+def has_non_latin_characters(name):
+    return bool(NON_LATIN_RE.search(name))
+
+def tokenize(name):
+    name = name.replace('-', '_').lower()
+    return name.split('_')
+
+def initialize(name):
+    tokens = tokenize(name)
+
+    if any(NUMBER_RE.match(t) for t in tokens):
+        return name
+
+    if len(tokens) < 2:
+        return name
+
+    try:
+        initials = '_'.join(s[0] + '.' for s in tokens[:-1])
+    except:
+        return name
+
+    return initials + tokens[-1]
+
+def transliterate(name):
+    if has_non_latin_characters(name):
+        return unidecode(name)
+
+    return name
+
+# Functions computing a key from a name, along with their version, to be
+# bumped whenever their output changes. Transliterations are computed from
+# the name itself, every other key from its transliteration.
+TRANSLITERATION_FUNCTIONS = [
+    ('transliteration', transliterate, 1),
+    ('normalized_transliteration', unidecode, 1)
+]
+
+KEY_FUNCTIONS = [
+    ('normalization', process, 1),
+    ('harsh_normalization', process_harsher, 1),
+    ('initials', initialize, 1),
+    ('fingerprint', fingerprint, 1),
+    ('bigram_fingerprint', partial(ngrams_fingerprint, 2), 1),
+    ('cologne', safe_cologne, 1),
+    ('rusalka', rusalka, 1)
+]
+
+FUNCTIONS = {name: fn for name, fn, _ in TRANSLITERATION_FUNCTIONS + KEY_FUNCTIONS}
+
+def library_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+# Versions used to invalidate cached keys, which also depend on the version
+# of the library doing the heavy lifting
+def get_versions():
+    unidecode_version = library_version('Unidecode')
+    fog_version = library_version('fog')
+
+    versions = {}
+
+    for name, _, version in TRANSLITERATION_FUNCTIONS:
+        versions[name] = '%i+unidecode-%s' % (version, unidecode_version)
+
+    for name, _, version in KEY_FUNCTIONS:
+        versions[name] = '%i+fog-%s' % (version, fog_version)
+
+    return versions
+
+def compute_chunk(task):
+    method, values = task
+    fn = FUNCTIONS[method]
+
+    return [fn(value) for value in values]
+
+# Function computing a method's key for every given distinct value, as a
+# column holding one code per value. Keys found in the cache are reused,
+# the other ones are computed in the pool and added to the cache.
+def compute_column(pool, method, values, cache=None, chunk_size=CHUNK_SIZE):
+    known = cache.get(method, values) if cache is not None else {}
+    missing = [value for value in values if value not in known]
+
+    if missing:
+        chunks = ((method, missing[i:i + chunk_size]) for i in range(0, len(missing), chunk_size))
+        keys = itertools.chain.from_iterable(pool.imap(compute_chunk, chunks))
+
+        computed = list(zip(missing, keys))
+        known.update(computed)
+
+        if cache is not None:
+            cache.set(method, computed)
+
+    print('  %s: %i cached, %i computed' % (method, len(values) - len(missing), len(missing)))
+
+    column = Column()
+
+    for value in values:
+        column.append(known[value])
+
+    return column
+
+# Function going from a column of keys, holding one code per distinct value,
+# to one code per row, given the codes of the rows' values
+def broadcast(column, codes):
+    per_value = column.array()
+
+    if len(per_value) == 0:
+        per_row = np.full(len(codes), -1, dtype=np.int32)
+    else:
+        per_row = per_value[codes]
+        per_row[codes < 0] = -1
+
+    column.codes = array('i', per_row.tobytes())
+    column.freeze()
+
+    return column
+
+# Function computing every key of the given column of names, in a pool of
+# processes. Keys only depend on the name, so they are computed once per
+# distinct name, or per distinct transliteration, then broadcast to the rows
+# as columns of key codes.
+def compute_keys(names, processes=None, cache=None):
+    columns = {}
+    name_codes = names.array()
+
+    # Workers are forked, as spawned ones would re-run the calling script
+    context = multiprocessing.get_context('fork')
+
+    with context.Pool(processes) as pool:
+        for method, _, _ in TRANSLITERATION_FUNCTIONS:
+            column = compute_column(pool, method, names.categories, cache)
+            columns[method] = broadcast(column, name_codes)
+
+        transliterations = columns['transliteration']
+        transliteration_codes = transliterations.array()
+
+        for method, _, _ in KEY_FUNCTIONS:
+            column = compute_column(pool, method, transliterations.categories, cache)
+            columns[method] = broadcast(column, transliteration_codes)
+
+    return columns
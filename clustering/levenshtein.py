@@ -0,0 +1,141 @@
+import numpy as np
+from Levenshtein import distance as levenshtein
+
+WORD_SIZE = 64
+BATCH_SIZE = 16384
+TABLE_SIZE = 1 << 22
+
+ONE = np.uint64(1)
+
+# Strings encoded once as a single array of characters, along with the
+# offsets of each string, so that batches of them can be compared at once.
+# Characters are numbered from 1 in a dense alphabet, 0 being the padding.
+class EncodedStrings(object):
+    def __init__(self, strings):
+        self.strings = strings
+        self.lengths = np.fromiter((len(s) for s in strings), dtype=np.int64, count=len(strings))
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)))
+
+        buffer = np.frombuffer(''.join(strings).encode('utf-32-le'), dtype=np.uint32)
+        characters, buffer = np.unique(buffer, return_inverse=True)
+
+        self.alphabet = len(characters) + 1
+        self.buffer = (buffer + 1).astype(np.uint32)
+
+    def __len__(self):
+        return len(self.strings)
+
+    # Function returning the given strings as rows of a padded matrix
+    def padded(self, indices, width):
+        positions = self.offsets[indices][:, None] + np.arange(width)
+        inside = np.arange(width) < self.lengths[indices][:, None]
+
+        if len(self.buffer) == 0:
+            return np.zeros((len(indices), width), dtype=np.uint32)
+
+        return np.where(inside, self.buffer[np.minimum(positions, len(self.buffer) - 1)], 0).astype(np.uint32)
+
+# Myers' bit-parallel algorithm, as formulated by Hyyrö, computing the
+# Levenshtein distance of many pairs of strings at once, one pair per lane.
+# Patterns must not be longer than the machine word. Pairs are dropped as soon
+# as their distance cannot be under k anymore.
+def myers_within_distance(strings, patterns, texts, k):
+    m = strings.lengths[patterns]
+    n = strings.lengths[texts]
+
+    width = max(1, int(m.max()))
+    length = int(n.max())
+
+    A = strings.padded(patterns, width)
+    B = strings.padded(texts, length)
+
+    # Bitmask of the pattern's positions holding each character of the
+    # alphabet, per lane, the padding never matching anything
+    lanes, positions = np.nonzero(np.arange(width) < m[:, None])
+    keys = lanes * strings.alphabet + A[lanes, positions]
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    bits = ONE << positions[order].astype(np.uint64)
+
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+    table = np.zeros(len(patterns) * strings.alphabet, dtype=np.uint64)
+    table[keys[starts]] = np.bitwise_or.reduceat(bits, starts)
+
+    # Looking up the bitmask of each of the text's characters, column-wise
+    peq = table[(np.arange(len(texts)) * strings.alphabet)[None, :] + B.T]
+
+    lanes = np.arange(len(patterns))
+    highest = ONE << (m.astype(np.uint64) - ONE)
+
+    pv = np.full(len(lanes), ~np.uint64(0), dtype=np.uint64)
+    mv = np.zeros(len(lanes), dtype=np.uint64)
+    score = m.copy()
+
+    result = np.zeros(len(patterns), dtype=bool)
+
+    for j in range(length):
+        running = j < n[lanes]
+
+        eq = peq[j, lanes]
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+
+        h = highest[lanes]
+        score += running * (((ph & h) != 0).astype(np.int64) - ((mh & h) != 0).astype(np.int64))
+
+        ph = (ph << ONE) | ONE
+        mh = mh << ONE
+
+        pv = np.where(running, mh | ~(xv | ph), pv)
+        mv = np.where(running, ph & xv, mv)
+
+        # Every remaining column can lower the distance by one at most
+        alive = score - np.maximum(n[lanes] - j - 1, 0) <= k
+
+        if not alive.all():
+            lanes, pv, mv, score = lanes[alive], pv[alive], mv[alive], score[alive]
+
+            if len(lanes) == 0:
+                break
+
+    result[lanes] = score <= k
+
+    return result
+
+# Function returning, for each pair of encoded strings, whether their
+# Levenshtein distance is at most k
+def within_distance(strings, A, B, k, batch_size=BATCH_SIZE):
+    A = np.asarray(A, dtype=np.int64)
+    B = np.asarray(B, dtype=np.int64)
+
+    # The shortest string of each pair is used as the pattern
+    swap = strings.lengths[A] > strings.lengths[B]
+    patterns = np.where(swap, B, A)
+    texts = np.where(swap, A, B)
+
+    m = strings.lengths[patterns]
+    n = strings.lengths[texts]
+
+    result = (patterns == texts) | ((m == 0) & (n <= k))
+
+    candidates = np.flatnonzero(~result & (n - m <= k) & (m > 0))
+
+    # Patterns too long for a single word are rare enough
+    too_long = candidates[m[candidates] > WORD_SIZE]
+
+    for i in too_long:
+        result[i] = levenshtein(strings.strings[patterns[i]], strings.strings[texts[i]]) <= k
+
+    candidates = candidates[m[candidates] <= WORD_SIZE]
+
+    # Keeping the per-lane tables of the alphabet within bounds
+    batch_size = max(1, min(batch_size, TABLE_SIZE // strings.alphabet))
+
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+        result[batch] = myers_within_distance(strings, patterns[batch], texts[batch], k)
+
+    return result
@@ -0,0 +1,109 @@
+import numpy as np
+
+from levenshtein import EncodedStrings
+from snm import group_items
+
+NGRAMS = 3
+PERMUTATIONS = 32
+BANDS = 8
+THRESHOLD = 0.6
+SEED = 1789
+CHUNK_SIZE = 50_000
+
+MIX = np.uint64(0x100000001B3)
+
+# Function returning the character n-grams of the given encoded strings, as
+# integers, along with the offset of the first n-gram of each string. Strings
+# shorter than n are given a single n-gram, padded with zeros.
+def ngrams(encoded, indices, n=NGRAMS):
+    lengths = encoded.lengths[indices]
+    counts = np.maximum(lengths - n + 1, 1)
+
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # Position of each n-gram in its string
+    positions = np.arange(counts.sum()) - np.repeat(starts, counts)
+    ends = np.repeat(lengths, counts)
+    offsets = np.repeat(encoded.offsets[indices], counts) + positions
+
+    grams = np.zeros(len(positions), dtype=np.uint64)
+    last = max(len(encoded.buffer) - 1, 0)
+
+    for i in range(n):
+        inside = positions + i < ends
+        characters = encoded.buffer[np.minimum(offsets + i, last)] if len(encoded.buffer) else 0
+        grams = grams * np.uint64(encoded.alphabet) + np.where(inside, characters, 0).astype(np.uint64)
+
+    return grams, starts
+
+# Function returning the MinHash signatures of the given encoded strings, one
+# row per string, using multiply-shift hashing of their n-grams
+def signatures(encoded, indices, permutations=PERMUTATIONS, n=NGRAMS, seed=SEED, chunk_size=CHUNK_SIZE):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 1 << 62, size=permutations, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+    b = rng.randint(0, 1 << 62, size=permutations, dtype=np.int64).astype(np.uint64)
+
+    result = np.empty((len(indices), permutations), dtype=np.uint64)
+
+    # Strings are processed by chunks, so as to bound the n-gram matrix
+    for start in range(0, len(indices), chunk_size):
+        grams, starts = ngrams(encoded, indices[start:start + chunk_size], n)
+
+        hashes = (grams[:, None] * a + b) >> np.uint64(32)
+        result[start:start + len(starts)] = np.minimum.reduceat(hashes, starts, axis=0)
+
+    return result
+
+# MinHash clustering of strings sharing enough character n-grams, using
+# locality-sensitive hashing: signatures are split into bands and strings
+# agreeing on every row of a band fall into the same bucket. Buckets are not
+# merged across bands, which would chain most strings together: bands are
+# processed in turn, each string being kept in the first bucket where the
+# estimated Jaccard similarity with the bucket's first string reaches the
+# threshold. Memory thus only depends on the number of strings and bands.
+# Items are given as the array of the index of their string, -1 meaning no
+# string.
+#
+# Clusters are ordered by their first item.
+def minhash_lsh(strings, codes, bands=BANDS, permutations=PERMUTATIONS, threshold=THRESHOLD, n=NGRAMS, seed=SEED, min_size=2, max_size=float('inf')):
+    codes = np.asarray(codes, dtype=np.int64)
+    rows = permutations // bands
+
+    encoded = EncodedStrings(strings)
+
+    # Only hashing the strings of some item
+    used = np.zeros(len(strings), dtype=bool)
+    used[codes[codes >= 0]] = True
+    indices = np.flatnonzero(used)
+
+    S = signatures(encoded, indices, permutations, n, seed)
+
+    roots = np.arange(len(strings), dtype=np.int64)
+    remaining = np.arange(len(indices))
+
+    for band in range(bands):
+        if len(remaining) == 0:
+            break
+
+        keys = np.zeros(len(remaining), dtype=np.uint64)
+
+        for row in range(band * rows, (band + 1) * rows):
+            keys = (keys ^ S[remaining, row]) * MIX
+
+        order = remaining[np.argsort(keys, kind='stable')]
+        keys = np.sort(keys, kind='stable')
+
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        sizes = np.diff(np.append(starts, len(keys)))
+
+        # Comparing every string of a bucket with its first string
+        first = np.repeat(order[starts], sizes)
+        similar = (S[order] == S[first]).mean(axis=1) >= threshold
+
+        members = np.add.reduceat(similar.astype(np.int64), starts)
+        kept = similar & np.repeat(members > 1, sizes)
+
+        roots[indices[order[kept]]] = indices[first[kept]]
+        remaining = np.setdiff1d(remaining, order[kept], assume_unique=True)
+
+    yield from group_items(codes, roots, min_size, max_size)
@@ -0,0 +1,164 @@
+import numpy as np
+from array import array
+from collections import defaultdict
+from multiprocessing import current_process, get_context
+
+from levenshtein import EncodedStrings, within_distance
+from snm import connected_components, group_items
+
+CHUNK_SIZE = 10_000
+
+# NOTE: shared with the forked workers, so that the index is never copied
+JOIN = {}
+
+# Function returning the (start, length) of the k + 1 segments of a string of
+# the given length, the last ones being one character longer when the length
+# cannot be divided evenly
+def partition(length, k):
+    size, longer = divmod(length, k + 1)
+    start = 0
+
+    for i in range(k + 1):
+        segment = size + (1 if i >= k + 1 - longer else 0)
+        yield start, segment
+        start += segment
+
+# Function indexing the segments of every string at least k + 1 characters
+# long, by (length, segment number, segment)
+def build_index(strings, ids, k):
+    index = defaultdict(list)
+
+    for i in ids:
+        s = strings[i]
+
+        for n, (start, length) in enumerate(partition(len(s), k)):
+            index[(len(s), n, s[start:start + length])].append(i)
+
+    return index
+
+# Function returning the candidates of a string among the indexed strings of
+# the given length. Following Pass-Join's multi-match-aware selection, a
+# segment is only looked up at the positions where it can be the first one
+# to match in an alignment of at most k edits.
+def probe(index, s, length, segments, k):
+    delta = len(s) - length
+
+    for n, (start, segment) in enumerate(segments):
+        low = max(start - n, start + delta - (k - n), 0)
+        high = min(start + n, start + delta + (k - n), len(s) - segment)
+
+        for p in range(low, high + 1):
+            yield from index.get((length, n, s[p:p + segment]), ())
+
+# Function joining a chunk of strings, sorted by length, with every indexed
+# string that is not longer, returning the pairs within distance k
+def join_chunk(bounds):
+    strings, index, k = JOIN['strings'], JOIN['index'], JOIN['k']
+    start, end = bounds
+
+    A = array('q')
+    B = array('q')
+
+    partitions = {}
+
+    for i in JOIN['order'][start:end].tolist():
+        s = strings[i]
+        candidates = set()
+
+        for length in range(max(len(s) - k, k + 1), len(s) + 1):
+            segments = partitions.get(length)
+
+            if segments is None:
+                segments = list(partition(length, k))
+                partitions[length] = segments
+
+            # NOTE: pairs of strings of the same length would be found twice
+            if length < len(s):
+                candidates.update(probe(index, s, length, segments, k))
+            else:
+                candidates.update(j for j in probe(index, s, length, segments, k) if j < i)
+
+        A.extend([i] * len(candidates))
+        B.extend(candidates)
+
+    A = np.frombuffer(A, dtype=np.int64)
+    B = np.frombuffer(B, dtype=np.int64)
+
+    matches = within_distance(JOIN['encoded'], A, B, k)
+
+    return A[matches], B[matches]
+
+# Function returning the pairs of strings shorter than k + 1 characters, which
+# cannot be partitioned, with every string within k characters of their length
+def join_short_strings(encoded, lengths, k):
+    short = np.flatnonzero(lengths <= k)
+    others = np.flatnonzero(lengths <= 2 * k)
+
+    A = np.repeat(short, len(others))
+    B = np.tile(others, len(short))
+
+    candidates = (A != B) & ((lengths[A] < lengths[B]) | ((lengths[A] == lengths[B]) & (A < B)))
+    A = A[candidates]
+    B = B[candidates]
+
+    matches = within_distance(encoded, A, B, k)
+
+    return A[matches], B[matches]
+
+# Levenshtein similarity join, after Pass-Join (Li et al., 2011), clustering
+# the items whose strings are within distance k of each other. Strings are
+# split into k + 1 segments, one of which must be found unchanged in any
+# string within distance k, so that candidates are found through an inverted
+# index of the segments and then verified on pre-encoded strings. Strings are
+# joined in parallel, by chunks of strings of similar length. Items are given
+# as the array of the index of their string, -1 meaning no string.
+#
+# Clusters are the connected components of the matching pairs, ordered by
+# their first item.
+def passjoin(strings, codes, k=1, processes=None, min_size=2, max_size=float('inf'), chunk_size=CHUNK_SIZE):
+    codes = np.asarray(codes, dtype=np.int64)
+
+    encoded = EncodedStrings(strings)
+    lengths = encoded.lengths
+
+    # Only joining the strings of some item
+    used = np.zeros(len(strings), dtype=bool)
+    used[codes[codes >= 0]] = True
+
+    ids = np.flatnonzero(used & (lengths > k))
+    order = ids[np.argsort(lengths[ids], kind='stable')]
+
+    JOIN.update(
+        strings=strings,
+        encoded=encoded,
+        index=build_index(strings, order.tolist(), k),
+        order=order,
+        k=k
+    )
+
+    chunks = [(i, min(i + chunk_size, len(order))) for i in range(0, len(order), chunk_size)]
+
+    try:
+
+        # NOTE: pool workers, e.g. when blocking, cannot have children
+        if processes != 1 and current_process().daemon:
+            print('Warning: pass-join running on a single process, since pool workers cannot have children')
+
+        if processes == 1 or current_process().daemon:
+            pairs = [join_chunk(chunk) for chunk in chunks]
+        else:
+            with get_context('fork').Pool(processes) as pool:
+                pairs = pool.map(join_chunk, chunks)
+    finally:
+        JOIN.clear()
+
+    short_lengths = np.where(used, lengths, np.iinfo(np.int64).max)
+    pairs.append(join_short_strings(encoded, short_lengths, k))
+
+    A = np.concatenate([a for a, _ in pairs])
+    B = np.concatenate([b for _, b in pairs])
+
+    # Items sharing the same string always belong to the same cluster
+    roots = connected_components(len(strings), A, B)
+
+    yield from group_items(codes, roots, min_size, max_size)
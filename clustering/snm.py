@@ -0,0 +1,143 @@
+import numpy as np
+from collections import defaultdict
+
+from levenshtein import EncodedStrings, within_distance
+
+# Function returning the items sorted by the key of their string, as a stable
+# permutation. Strings are only compared once per distinct value, items being
+# given as the array of the index of their string.
+def sort_order(strings, codes, key=None):
+    order = sorted(range(len(strings)), key=lambda i: strings[i] if key is None else key(strings[i]))
+    ranks = np.empty(len(strings), dtype=np.int64)
+
+    rank = -1
+    previous = None
+
+    for i in order:
+        value = strings[i] if key is None else key(strings[i])
+
+        if rank < 0 or value != previous:
+            rank += 1
+            previous = value
+
+        ranks[i] = rank
+
+    return np.argsort(ranks[codes], kind='stable')
+
+# Function returning the smallest item of the connected component of each
+# item, given the edges of the graph as two arrays. Every item is hooked to
+# the smallest label among its neighbors, then labels are shortcut, until
+# nothing changes, so that the whole graph is processed at once.
+def connected_components(n, A, B):
+    labels = np.arange(n, dtype=np.int64)
+
+    while True:
+        a = labels[A]
+        b = labels[B]
+
+        changed = a != b
+
+        if not changed.any():
+            return labels
+
+        a = a[changed]
+        b = b[changed]
+
+        targets = np.concatenate((a, b))
+        values = np.concatenate((np.minimum(a, b), np.minimum(a, b)))
+
+        order = np.argsort(targets, kind='stable')
+        targets = targets[order]
+        values = values[order]
+
+        starts = np.flatnonzero(np.concatenate(([True], targets[1:] != targets[:-1])))
+        targets = targets[starts]
+
+        labels[targets] = np.minimum(labels[targets], np.minimum.reduceat(values, starts))
+
+        while True:
+            shortcut = labels[labels]
+
+            if (shortcut == labels).all():
+                break
+
+            labels = shortcut
+
+# Function grouping the items by the component of their string, as computed
+# by connected_components, items without string being given as -1. Clusters
+# are ordered by their first item.
+def group_items(codes, roots, min_size=2, max_size=float('inf')):
+    items = np.flatnonzero(codes >= 0)
+    components = defaultdict(list)
+
+    for item, root in zip(items.tolist(), roots[codes[items]].tolist()):
+        components[root].append(item)
+
+    for cluster in components.values():
+        if min_size <= len(cluster) <= max_size:
+            yield cluster
+
+# Sorted neighborhood method, matching every item with the items following it
+# in a window, for each of the given sort orders, whenever the Levenshtein
+# distance of their strings is at most the radius. Items are given as the
+# array of the index of their string, so that distances are computed, whole
+# offsets of the windows at a time, on pre-encoded strings.
+#
+# Clusters are the connected components of the matching pairs and are yielded
+# in the same order as fog's sorted_neighborhood.
+def sorted_neighborhood(strings, codes, orders, radius=1, window=10, min_size=2, max_size=float('inf')):
+    encoded = EncodedStrings(strings)
+    codes = np.asarray(codes, dtype=np.int64)
+
+    found_a = []
+    found_b = []
+    found_ranks = []
+
+    for p, order in enumerate(orders):
+        order = np.asarray(order, dtype=np.int64)
+        n = len(order)
+
+        for d in range(1, min(n, window)):
+            A = order[:-d]
+            B = order[d:]
+
+            matches = np.flatnonzero(within_distance(encoded, codes[A], codes[B], radius))
+
+            found_a.append(A[matches])
+            found_b.append(B[matches])
+
+            # Rank of the pair in the order pairs would be compared one by one
+            found_ranks.append((p * n + matches) * window + d)
+
+    if not found_ranks:
+        return
+
+    A = np.concatenate(found_a)
+    B = np.concatenate(found_b)
+    ranks = np.concatenate(found_ranks)
+
+    roots = connected_components(len(codes), A, B)
+
+    # Position at which each item first appears in the stream of pairs, as
+    # they would be found comparing them one by one
+    items = np.concatenate((A, B))
+    positions = np.concatenate((ranks * 2, ranks * 2 + 1))
+
+    order = np.argsort(positions, kind='stable')
+    items, first = np.unique(items[order], return_index=True)
+    first = positions[order][first]
+
+    # Clusters are ordered by the first appearance of one of their items,
+    # and so are the items of each cluster
+    order = np.argsort(first, kind='stable')
+    items = items[order]
+    item_roots = roots[items]
+
+    components = defaultdict(list)
+
+    for item, root in zip(items.tolist(), item_roots.tolist()):
+        components[root].append(item)
+
+    for cluster in components.values():
+        if min_size <= len(cluster) <= max_size:
+            yield cluster
@@ -0,0 +1,139 @@
+import numpy as np
+from array import array
+
+CHUNK_SIZE = 100_000
+
+# Categorical column of strings: an int32 code per row pointing to its value,
+# each distinct value being kept only once. Code -1 stands for a missing value.
+class Column(object):
+    def __init__(self, length=0):
+        self.codes = array('i', [-1]) * length
+        self.categories = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        code = self.codes[i]
+
+        if code < 0:
+            return ''
+
+        return self.categories[code]
+
+    def __setitem__(self, i, value):
+        self.codes[i] = self.intern(value)
+
+    def intern(self, value):
+        if value is None:
+            return -1
+
+        code = self.index.get(value)
+
+        if code is None:
+            code = len(self.categories)
+            self.index[value] = code
+            self.categories.append(value)
+
+        return code
+
+    def append(self, value):
+        self.codes.append(self.intern(value))
+
+    # Dropping the index once every row has been appended
+    def freeze(self):
+        self.index = None
+
+    # Numpy view over the codes, without copy
+    def array(self):
+        return np.frombuffer(self.codes, dtype=np.int32)
+
+# Record store replacing a list of dicts: one column per field, each row being
+# accessed through a lightweight view. Columns are either string columns or
+# numpy arrays, e.g. to hold cluster ids or confidences.
+class ColumnStore(object):
+    def __init__(self, fieldnames):
+        self.fieldnames = list(fieldnames)
+        self.columns = {name: Column() for name in self.fieldnames}
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return Row(self, i)
+
+    def __iter__(self):
+        return (Row(self, i) for i in range(self.length))
+
+    def append(self, row):
+        for name in self.fieldnames:
+            self.columns[name].append(row.get(name))
+
+        self.length += 1
+
+    def freeze(self):
+        for column in self.columns.values():
+            if isinstance(column, Column):
+                column.freeze()
+
+    def add_column(self, name, column=None):
+        if column is None:
+            column = Column(self.length)
+
+        self.columns[name] = column
+        self.fieldnames.append(name)
+
+        return self.columns[name]
+
+    # Preallocating a numpy column filled with the given missing value
+    def add_array(self, name, dtype, fill):
+        self.columns[name] = np.full(self.length, fill, dtype=dtype)
+        self.fieldnames.append(name)
+
+        return self.columns[name]
+
+    def get(self, i, name):
+        return self.columns[name][i]
+
+    # Function yielding rows as lists of strings, missing numbers being blank.
+    # Numeric columns are formatted by chunks to keep memory usage bounded.
+    def rows(self, fieldnames=None, chunk_size=CHUNK_SIZE):
+        if fieldnames is None:
+            fieldnames = self.fieldnames
+
+        columns = [self.columns[name] for name in fieldnames]
+
+        for start in range(0, self.length, chunk_size):
+            end = min(self.length, start + chunk_size)
+            chunk = []
+
+            for column in columns:
+                if isinstance(column, Column):
+                    chunk.append([column[i] for i in range(start, end)])
+                elif column.dtype.kind == 'f':
+                    chunk.append(['' if np.isnan(v) else str(v) for v in column[start:end]])
+                else:
+                    chunk.append(['' if v < 0 else str(v) for v in column[start:end].tolist()])
+
+            yield from zip(*chunk)
+
+class Row(object):
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.store.get(self.index, name)
+
+    def __setitem__(self, name, value):
+        self.store.columns[name][self.index] = value
+
+    def get(self, name, default=None):
+        if name not in self.store.columns:
+            return default
+
+        return self[name]
@@ -0,0 +1,51 @@
+from array import array
+from collections import defaultdict
+
+# Disjoint sets over the integers 0..n-1, kept in flat arrays, with union by
+# size and path halving, so that any sequence of operations runs in
+# near-linear time.
+class UnionFind(object):
+    def __init__(self, n):
+        self.parent = array('l', range(n))
+        self.size = array('l', [1]) * n
+
+    def __len__(self):
+        return len(self.parent)
+
+    def find(self, x):
+        parent = self.parent
+
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+
+        return x
+
+    # Merging the sets of a & b, returning the root of the resulting set
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+
+        if a == b:
+            return a
+
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+        return a
+
+    # Function returning the sets having at least min_size items, as sorted
+    # lists, ordered by their smallest item
+    def components(self, min_size=2):
+        groups = defaultdict(list)
+
+        for x in range(len(self.parent)):
+            root = self.find(x)
+
+            if self.size[root] >= min_size:
+                groups[root].append(x)
+
+        return list(groups.values())
@@ -1,88 +1,211 @@
+import os
 import csv
 import json
+import itertools
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
 from minet import multithreaded_fetch
 from tqdm import tqdm
-from collections import defaultdict
+from collections import Counter
+
+INPUT = './missing_creationdate.csv'
+OUTPUT = './creationdates.csv'
+CHECKPOINT = './creationdates.checkpoint'
 
 PARALLELISM = 10
-GROUPS = 50
 LIMIT = None
+FLUSH_EVERY = 1000
 
 REPORT_HEADERS = ['lang', 'name', 'timestamp']
 
 URL_TEMPLATE = 'https://%s.wikipedia.org/w/api.php?action=query&prop=revisions&rvlimit=1&rvprop=timestamp&rvdir=newer&titles=%s&format=json'
 
-def chunker(iterator, size=GROUPS):
-    chunk = []
+def format_url(lang, name):
+    return URL_TEMPLATE % (lang, name)
 
-    for item in iterator:
-        if len(chunk) == size:
-            yield chunk
-            chunk = []
-        chunk.append(item)
+# Hashing a page into a 64 bits integer for the checkpoint
+def hash_page(lang, name):
+    key = ('%s\t%s' % (lang, name)).encode('utf-8')
 
-    yield chunk
+    return int.from_bytes(blake2b(key, digest_size=8).digest(), 'little')
 
-def format_url(lang, name):
-    return URL_TEMPLATE % (lang, name)
+# Loading the checkpoint as a sorted array of the hashes of pages already done,
+# which costs 8 bytes per page
+def load_checkpoint(path):
+    done = array('Q')
+
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        # Dropping a record truncated by a crash, if any
+        done.frombytes(data[:len(data) - len(data) % done.itemsize])
+
+    return array('Q', sorted(done))
+
+def is_done(lang, name):
+    h = hash_page(lang, name)
+    i = bisect_left(DONE, h)
+
+    return i < len(DONE) and DONE[i] == h
+
+# Streaming (start, end, lang, name) tuples from the input file, start & end
+# being the line's byte offsets, so that it can be read again from any line
+def read_input(start=0, end=None):
+    with open(INPUT, 'rb') as f:
+        f.seek(start)
+        offset = start
+
+        if start == 0:
+            offset += len(next(f))
+
+        for line in f:
+            line_start, offset = offset, offset + len(line)
+
+            row = next(csv.reader([line.decode('utf-8')]), None)
+
+            if row:
+                yield line_start, offset, row[0], row[1]
+
+            if end is not None and offset >= end:
+                break
+
+# Streaming the pages of the given language that are not done yet, reading
+# only the part of the input where they are found
+def read_pages(lang):
+    start, end = SPANS[lang]
+
+    for _, _, line_lang, name in read_input(start, end):
+        if line_lang == lang and not is_done(lang, name):
+            yield name
+
+# Iterating over every language's pages in turn, so that every host has
+# pending requests at any time instead of one language after the other
+def interleave(pages):
+    iterators = list(pages.values())
+    langs = list(pages.keys())
+
+    while iterators:
+        exhausted = []
 
+        for i, (lang, names) in enumerate(zip(langs, iterators)):
+            name = next(names, None)
+
+            if name is None:
+                exhausted.append(i)
+                continue
+
+            yield lang, name, format_url(lang, name)
+
+        for i in reversed(exhausted):
+            del iterators[i]
+            del langs[i]
+
+# Function returning the timestamp of a page's first revision, or None if it
+# has none, raising if the response cannot be parsed
 def extract_timestamp(response):
-    try:
-        data = json.loads(response.data.decode())
-        pages = data['query']['pages']
-        page = next(iter(pages.values()))
+    data = json.loads(response.data.decode())
+    pages = data['query']['pages']
+    page = next(iter(pages.values()))
+    revisions = page.get('revisions')
+
+    return revisions[0]['timestamp'] if revisions else None
+
+DONE = load_checkpoint(CHECKPOINT)
+
+# Counting pages left to do per language, and where they are found in the
+# input, without keeping them in memory
+PENDING = Counter()
+SPANS = {}
+
+lines = itertools.islice(read_input(), LIMIT)
+
+for start, end, lang, name in tqdm(lines, desc='Reading CSV file', unit=' lines'):
 
-        return page['revisions'][0]['timestamp']
-    except:
-        return None
+    # if lang != 'sat':
+    #     continue
 
-PAGES = defaultdict(list)
-with open('./missing_creationdate.csv') as f:
-    reader = csv.reader(f)
-    next(reader)
+    if is_done(lang, name):
+        continue
 
-    i = 0
-    for line in tqdm(reader, desc='Reading CSV file', unit=' lines'):
-        i += 1
+    PENDING[lang] += 1
 
-        # if line[0] != 'sat':
-        #     continue
+    if lang in SPANS:
+        SPANS[lang][1] = end
+    else:
+        SPANS[lang] = [start, end]
 
-        PAGES[line[0]].append(line[1])
+print('Already done %i pages.' % len(DONE))
 
-        if LIMIT is not None and i >= LIMIT:
-            break
+is_new = not os.path.exists(OUTPUT) or os.path.getsize(OUTPUT) == 0
 
-with open('./creationdates.csv', 'w') as output_file:
+with open(OUTPUT, 'a') as output_file, \
+     open(CHECKPOINT, 'ab') as checkpoint_file:
     writer = csv.writer(output_file)
-    writer.writerow(REPORT_HEADERS)
 
-    for lang, names in sorted(PAGES.items(), key=lambda x: len(x[1]), reverse=True):
-        urls = ((lang, name, format_url(lang, name)) for name in names)
-        missing = 0
+    if is_new:
+        writer.writerow(REPORT_HEADERS)
 
-        key = lambda x: x[2]
+    # The checkpoint is only written after the output it refers to
+    unflushed = array('Q')
 
-        loading_bar = tqdm(desc='Fetching %s' % lang, total=len(names))
+    def flush():
+        output_file.flush()
+        checkpoint_file.write(unflushed.tobytes())
+        checkpoint_file.flush()
+        del unflushed[:]
 
-        mf = multithreaded_fetch(
-            urls,
-            domain_parallelism=PARALLELISM,
-            throttle=0,
-            guess_encoding=False,
-            guess_extension=False,
-            key=key
-        )
+    # One fetch for every language at once, each host having its own
+    # parallelism limit
+    urls = interleave({lang: read_pages(lang) for lang in PENDING})
+    missing = 0
+    failed = 0
 
+    key = lambda x: x[2]
+
+    loading_bar = tqdm(desc='Fetching', total=sum(PENDING.values()))
+
+    mf = multithreaded_fetch(
+        urls,
+        threads=PARALLELISM * max(1, len(PENDING)),
+        domain_parallelism=PARALLELISM,
+        throttle=0,
+        guess_encoding=False,
+        guess_extension=False,
+        key=key
+    )
+
+    try:
         for result in mf:
             loading_bar.update()
-            timestamp = extract_timestamp(result.response)
-
             lang, name, url = result.item
 
+            # Failed pages are not recorded, so that the next run retries them
+            if result.error is not None or result.response.status != 200:
+                failed += 1
+                loading_bar.set_postfix(missing=missing, failed=failed)
+                continue
+
+            try:
+                timestamp = extract_timestamp(result.response)
+            except (ValueError, KeyError, IndexError, StopIteration, AttributeError):
+                failed += 1
+                loading_bar.set_postfix(missing=missing, failed=failed)
+                continue
+
             # assert timestamp is not None, 'Missing timestamp for %s %s %s' % result.item
             if timestamp is None:
                 missing += 1
-                loading_bar.set_postfix(missing=missing)
+                loading_bar.set_postfix(missing=missing, failed=failed)
 
             writer.writerow([lang, name, timestamp or ''])
+            unflushed.append(hash_page(lang, name))
+
+            if len(unflushed) >= FLUSH_EVERY:
+                flush()
+    finally:
+        flush()
+
+    if failed:
+        print('%i pages failed and will be retried by the next run.' % failed)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# ============================
+# BHHT Wikipedia API Benchmark
+# ============================
+#
+# Script running the API script against a local stub of the pageviews
+# per-article endpoint, so that its throughput can be measured offline and
+# reproducibly. The stub's latency, payload size and error rates can be
+# configured, and every argument not known to this script is passed along to
+# the API script. Latencies & retries are those reported by the API script
+# itself:
+#
+#   python benchmark.py --rows 10000 --latency lognormal:0.1,0.5 -- --concurrency 50
+#
+from aiohttp import web
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from periods import get_periods
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script.py')
+
+RESPONSE_RE = re.compile(r'^Response .*: HTTP \d+ in ([\d.]+)ms$')
+
+# Function parsing a latency distribution, given as "constant:s",
+# "uniform:min,max", "exponential:mean" or "lognormal:median,sigma", into
+# a function returning a latency in seconds
+def parse_latency(spec):
+    name, _, params = spec.partition(':')
+    params = [float(p) for p in params.split(',') if p]
+
+    if name == 'constant':
+        return lambda: params[0]
+
+    if name == 'uniform':
+        return lambda: random.uniform(params[0], params[1])
+
+    if name == 'exponential':
+        return lambda: random.expovariate(1 / params[0])
+
+    if name == 'lognormal':
+        return lambda: random.lognormvariate(math.log(params[0]), params[1])
+
+    raise ValueError('Unknown latency distribution: %s' % spec)
+
+# Function returning the given percentile of sorted values
+def percentile(values, p):
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+class Stub(object):
+    def __init__(self, latency, rate_limited=0.0, server_errors=0.0,
+                 retry_after=None, padding=0):
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.server_errors = server_errors
+        self.retry_after = retry_after
+        self.padding = 'x' * padding
+
+        self.responses = 0
+
+    async def handle(self, request):
+        params = request.match_info
+
+        await asyncio.sleep(self.latency())
+
+        roll = random.random()
+
+        if roll < self.rate_limited:
+            headers = {}
+
+            if self.retry_after is not None:
+                headers['Retry-After'] = str(self.retry_after)
+
+            response = web.Response(status=429, headers=headers)
+
+        elif roll < self.rate_limited + self.server_errors:
+            response = web.Response(status=503)
+
+        else:
+            items = [
+                {
+                    'project': params['project'],
+                    'article': params['name'],
+                    'granularity': params['granularity'],
+                    'timestamp': period + '00',
+                    'access': params['access'],
+                    'agent': params['agent'],
+                    'views': random.randint(0, 10000),
+                    'padding': self.padding
+                }
+                for period in get_periods(params['start'][:8], params['end'][:8], params['granularity'])
+            ]
+
+            response = web.Response(text=json.dumps({'items': items}), content_type='application/json')
+            self.responses += 1
+
+        return response
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get(
+            '/{project}/{access}/{agent}/{name:.+}/{granularity}/{start}/{end}',
+            self.handle
+        )
+
+        return app
+
+def write_input(file_path, rows):
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write('lang,id,name\n')
+
+        for i in range(rows):
+            f.write('en,%i,Benchmark_page_%i\n' % (i, i))
+
+# Coroutine reading the API script's output, collecting the latency of each
+# of its requests, as timed by the script, and counting its retries as well
+# as the rows it gave up on
+async def read_output(stream, stats):
+    async for line in stream:
+        line = line.decode('utf-8', errors='replace').rstrip('\n')
+        match = RESPONSE_RE.match(line)
+
+        if match is not None:
+            stats['latencies'].append(float(match.group(1)) / 1000)
+        elif line.startswith('Retrying '):
+            stats['retries'] += 1
+        elif line.startswith('Giving up '):
+            stats['given_up'] += 1
+
+async def benchmark(stub, rows, script_args):
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+
+    host, port = runner.addresses[0][:2]
+    url = 'http://%s:%i' % (host, port)
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_file_path = os.path.join(directory, 'input.csv')
+        output_file_path = os.path.join(directory, 'output.csv')
+
+        write_input(input_file_path, rows)
+
+        started_at = time.monotonic()
+
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, SCRIPT_PATH, input_file_path, output_file_path,
+            '--url', url, *script_args,
+            stdout=subprocess.PIPE
+        )
+
+        stats = {'latencies': [], 'retries': 0, 'given_up': 0}
+
+        await read_output(process.stdout, stats)
+        await process.wait()
+
+        elapsed = time.monotonic() - started_at
+
+    await runner.cleanup()
+
+    return elapsed, process.returncode, stats
+
+def report(stub, rows, elapsed, returncode, stats):
+    latencies = sorted(stats['latencies'])
+
+    # NOTE: ru_maxrss is given in kilobytes on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    print('Fetched %i/%i rows in %.2fs (exit code %i)' % (stub.responses, rows, elapsed, returncode))
+    print('  rows/s: %.1f' % (stub.responses / elapsed))
+    print('  requests: %i' % len(latencies))
+    print('  retries: %i' % stats['retries'])
+    print('  rows given up: %i' % stats['given_up'])
+    print('  latency p50: %.1fms' % (percentile(latencies, 50) * 1000))
+    print('  latency p99: %.1fms' % (percentile(latencies, 99) * 1000))
+    print('  peak RSS: %.1fMB' % peak_rss)
+
+# Launching process if script is invoked as main
+if __name__ == '__main__':
+    import argparse
+
+    # Parsing command line arguments
+    parser = argparse.ArgumentParser(usage='%(prog)s [options] [-- script options]')
+    parser.add_argument('--rows', type=int, default=10000, help='Number of rows of the generated input. Defaults to %(default)s.')
+    parser.add_argument('--latency', default='lognormal:0.05,0.5', help='Latency distribution of the stub: constant:s, uniform:min,max, exponential:mean or lognormal:median,sigma. Defaults to %(default)s.')
+    parser.add_argument('--rate-limited', type=float, default=0.0, help='Proportion of 429 responses. Defaults to %(default)s.')
+    parser.add_argument('--server-errors', type=float, default=0.0, help='Proportion of 503 responses. Defaults to %(default)s.')
+    parser.add_argument('--retry-after', type=float, help='Retry-After header sent along 429 responses.')
+    parser.add_argument('--padding', type=int, default=0, help='Number of bytes added to each item of the payload. Defaults to %(default)s.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed. Defaults to %(default)s.')
+    args, script_args = parser.parse_known_args()
+
+    if script_args and script_args[0] == '--':
+        script_args = script_args[1:]
+
+    random.seed(args.seed)
+
+    stub = Stub(
+        parse_latency(args.latency),
+        rate_limited=args.rate_limited,
+        server_errors=args.server_errors,
+        retry_after=args.retry_after,
+        padding=args.padding
+    )
+
+    loop = asyncio.get_event_loop()
+    elapsed, returncode, stats = loop.run_until_complete(benchmark(stub, args.rows, script_args))
+
+    report(stub, args.rows, elapsed, returncode, stats)
@@ -0,0 +1,121 @@
+# ===========================
+# BHHT Wikipedia API Checkpoint
+# ===========================
+#
+# Compact resume store recording which rows of the input file are done.
+#
+# The file starts with a watermark: the byte offset (and row number) in the
+# input before which every row is either done or listed as failed. It is
+# followed by fixed-size records (start offset, end offset, row number, status)
+# appended as rows complete, in whatever order they complete.
+#
+# When loading, records are folded back into the watermark, so that only
+# failed rows and rows done out of order right after the watermark are kept in
+# memory, and the file is compacted to this same small state. Resuming then
+# amounts to retrying failed rows and seeking the input to the watermark.
+#
+from pathlib import Path
+import os
+import struct
+
+HEADER = struct.Struct('<QQ')
+RECORD = struct.Struct('<QQQB')
+
+DONE = 0
+FAILED = 1
+
+class Checkpoint(object):
+    def __init__(self, path):
+        self.path = Path(path)
+        self.offset = 0
+        self.row = 0
+        self.failed = {}
+        self.pending = {}
+        self.buffer = bytearray()
+
+        if self.path.exists():
+            self.load()
+
+        self.compact()
+        self.file = open(self.path, 'ab')
+
+    # Number of rows known to be done
+    def __len__(self):
+        done = sum(1 for _, _, status in self.pending.values() if status == DONE)
+
+        return self.row - len(self.failed) + done
+
+    # Whether the row starting at the given offset is done
+    def __contains__(self, start):
+        record = self.pending.get(start)
+
+        return record is not None and record[2] == DONE
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            header = f.read(HEADER.size)
+
+            if len(header) == HEADER.size:
+                self.offset, self.row = HEADER.unpack(header)
+
+            while True:
+                record = f.read(RECORD.size)
+
+                if len(record) < RECORD.size:
+                    break
+
+                self.fold(*RECORD.unpack(record))
+
+    # Merging a single record into the in-memory state
+    def fold(self, start, end, row, status):
+
+        # Row behind the watermark: a failed row being retried
+        if start < self.offset:
+            if status == DONE:
+                self.failed.pop(start, None)
+            else:
+                self.failed[start] = (end, row)
+
+            return
+
+        self.pending[start] = (end, row, status)
+
+        # Advancing the watermark
+        while self.offset in self.pending:
+            end, row, status = self.pending.pop(self.offset)
+
+            if status == FAILED:
+                self.failed[self.offset] = (end, row)
+
+            self.offset = end
+            self.row = row + 1
+
+    def compact(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(self.offset, self.row))
+
+            for start, (end, row) in sorted(self.failed.items()):
+                f.write(RECORD.pack(start, end, row, FAILED))
+
+            for start, (end, row, status) in sorted(self.pending.items()):
+                f.write(RECORD.pack(start, end, row, status))
+
+        os.replace(tmp_path, self.path)
+
+    def add(self, start, end, row, status=DONE):
+        self.buffer += RECORD.pack(start, end, row, status)
+
+    # Should only be called once the matching output has been flushed
+    def flush(self):
+        if not self.buffer:
+            return
+
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer.clear()
+
+    # Records not flushed yet are dropped, their rows will simply be redone
+    def close(self):
+        self.file.close()
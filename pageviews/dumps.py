@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# ===========================
+# BHHT Wikipedia Dumps Script
+# ===========================
+#
+# Offline alternative to the API script, aggregating the same page visits
+# from Wikimedia's pageview dump files downloaded on local disk:
+#
+#   https://dumps.wikimedia.org/other/pageviews/
+#   https://dumps.wikimedia.org/other/pageview_complete/
+#
+# Dump files are scanned in parallel, one per process, and only lines whose
+# page belongs to the input file are kept. The input titles are kept as a
+# sorted array of 64 bits hashes so that workers share a compact filter.
+#
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+import bz2
+import gzip
+import multiprocessing
+import os
+import re
+
+from periods import GRANULARITIES, format_period, get_period, get_periods
+from script import START_DATE, END_DATE, GRANULARITY, hash_row, input_file_generator, write_csv_line
+
+# Parameters
+PROCESSES = os.cpu_count()
+
+# Constants
+DATE_RE = re.compile(r'(\d{8})')
+ACCESS_METHODS = set([b'desktop', b'mobile-web', b'mobile-app'])
+WIKIPEDIA_DOMAIN_SUFFIXES = set([b'', b'm', b'wikipedia', b'm.wikipedia'])
+
+# State shared with the worker processes
+TITLES = array('Q')
+
+# Function hashing a page's title into a 64 bits integer
+def hash_title(name, lang):
+    key = hash_row({'name': name, 'lang': lang}).encode('utf-8')
+
+    return int.from_bytes(blake2b(key, digest_size=8).digest(), 'little')
+
+# Function returning the position of the given hash in the titles, if any
+def find_title(h):
+    i = bisect_left(TITLES, h)
+
+    if i < len(TITLES) and TITLES[i] == h:
+        return i
+
+    return None
+
+# Function returning the period of a dump file, as found in its name
+def get_file_period(file_path, granularity):
+    match = DATE_RE.search(os.path.basename(file_path))
+
+    if match is None:
+        raise ValueError('Could not find date in dump file name: %s' % file_path)
+
+    return get_period(match.group(1), granularity)
+
+def open_dump_file(file_path):
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rb')
+
+    if file_path.endswith('.bz2'):
+        return bz2.open(file_path, 'rb')
+
+    return open(file_path, 'rb')
+
+# Function parsing a dump line into a (lang, name, count) tuple.
+# Supports both hourly "domain title count bytes" lines and daily
+# "domain title page_id access count hourly_counts" lines.
+def parse_dump_line(line):
+    parts = line.rstrip(b'\n').split(b' ')
+
+    if len(parts) < 4:
+        return None
+
+    lang, _, suffix = parts[0].partition(b'.')
+
+    if suffix not in WIKIPEDIA_DOMAIN_SUFFIXES:
+        return None
+
+    if len(parts) >= 6 and parts[3] in ACCESS_METHODS:
+        count = parts[4]
+    else:
+        count = parts[2]
+
+    try:
+        return lang.decode('utf-8'), parts[1].decode('utf-8'), int(count)
+    except ValueError:
+        return None
+
+# Function run by the workers, returning the views found in a single dump file
+# as parallel arrays of title positions & counts
+def aggregate_file(file_path):
+    positions = array('L')
+    counts = array('Q')
+
+    with open_dump_file(file_path) as f:
+        for line in f:
+            parsed = parse_dump_line(line)
+
+            if parsed is None:
+                continue
+
+            lang, name, count = parsed
+            i = find_title(hash_title(name, lang))
+
+            if i is None:
+                continue
+
+            positions.append(i)
+            counts.append(count)
+
+    return file_path, positions, counts
+
+def main(input_file_path, output_file_path, dump_file_paths, periods,
+         granularity=GRANULARITY, processes=PROCESSES):
+    global TITLES
+
+    # Building the title filter
+    TITLES = array('Q', sorted(set(
+        hash_title(row['name'], row['lang'])
+        for _, _, _, row in input_file_generator(input_file_path)
+    )))
+
+    print('Filtering dumps on %i titles.' % len(TITLES))
+
+    # Finding the column of each dump file, skipping those out of range
+    columns = {period: column for column, period in enumerate(periods)}
+    files = {}
+
+    for file_path in dump_file_paths:
+        column = columns.get(get_file_period(file_path, granularity))
+
+        if column is not None:
+            files[file_path] = column
+
+    width = len(periods)
+    views = array('Q', [0]) * (len(TITLES) * width)
+
+    # Workers are forked so that they share the title filter
+    context = multiprocessing.get_context('fork')
+
+    with context.Pool(processes) as pool:
+        results = pool.imap_unordered(aggregate_file, list(files))
+
+        for done, (file_path, positions, counts) in enumerate(results, 1):
+            column = files[file_path]
+
+            for i, count in zip(positions, counts):
+                views[i * width + column] += count
+
+            print('(%i/%i) Aggregated %s' % (done, len(files), file_path))
+
+    # Writing the same rows as the API script
+    with open(output_file_path, 'w', encoding='utf-8') as f:
+        header = ['lang', 'id', 'name'] + [format_period(p, granularity) for p in periods]
+        f.write(write_csv_line(header) + '\n')
+
+        for _, _, _, row in input_file_generator(input_file_path):
+            i = find_title(hash_title(row['name'], row['lang']))
+
+            csv_line = write_csv_line([
+                row['lang'],
+                row.get('id', ''),
+                row['name']
+            ] + list(views[i * width:(i + 1) * width]))
+
+            f.write(csv_line + '\n')
+
+# Launching process if script is invoked as main
+if __name__ == '__main__':
+    import argparse
+
+    # Parsing command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='Path to the input file.')
+    parser.add_argument('output', help='Path to the output file.')
+    parser.add_argument('dumps', nargs='+', help='Paths to the pageview dump files.')
+    parser.add_argument('--start', default=START_DATE, help='First day of the periods to gather, as YYYYMMDD. Defaults to %(default)s.')
+    parser.add_argument('--end', default=END_DATE, help='Last day of the periods to gather, as YYYYMMDD. Defaults to %(default)s.')
+    parser.add_argument('--granularity', choices=GRANULARITIES, default=GRANULARITY, help='Defaults to %(default)s.')
+    parser.add_argument('-p', '--processes', type=int, default=PROCESSES, help='Number of processes to use.')
+    args = parser.parse_args()
+
+    periods = get_periods(args.start, args.end, args.granularity)
+
+    main(args.input, args.output, args.dumps, periods, args.granularity, args.processes)
@@ -0,0 +1,69 @@
+# ==========================
+# BHHT Wikipedia API Periods
+# ==========================
+#
+# Helpers dealing with the periods, i.e. months or days, for which page visits
+# are gathered. Periods are represented as YYYYMMDD strings, monthly periods
+# being represented by their first day.
+#
+from datetime import date, datetime, timedelta, timezone
+
+GRANULARITIES = ['monthly', 'daily']
+
+# Function parsing a YYYYMMDD or YYYY-MM-DD date
+def parse_date(value):
+    value = str(value).replace('-', '')
+
+    return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+
+# Function returning the list of periods between two dates, inclusive
+def get_periods(start_date, end_date, granularity='monthly'):
+    start_date = parse_date(start_date)
+    end_date = parse_date(end_date)
+
+    if granularity == 'monthly':
+        current = start_date.replace(day=1)
+        step = lambda d: (d + timedelta(days=32)).replace(day=1)
+    elif granularity == 'daily':
+        current = start_date
+        step = lambda d: d + timedelta(days=1)
+    else:
+        raise ValueError('Unknown granularity: %s' % granularity)
+
+    periods = []
+
+    while current <= end_date:
+        periods.append(current.strftime('%Y%m%d'))
+        current = step(current)
+
+    return periods
+
+# Function returning the period of a YYYYMMDD[HH] timestamp
+def get_period(timestamp, granularity='monthly'):
+    if granularity == 'monthly':
+        return timestamp[:6] + '01'
+
+    return timestamp[:8]
+
+# Function returning the last day of a period, as a YYYYMMDD string
+def get_period_end(period, granularity='monthly'):
+    if granularity == 'monthly':
+        start = parse_date(period)
+        return ((start + timedelta(days=32)).replace(day=1) - timedelta(days=1)).strftime('%Y%m%d')
+
+    return period
+
+# Function returning the given periods that are over, i.e. whose views can
+# already be published by the API, which lags about a day behind
+def get_complete_periods(periods, granularity='monthly', today=None):
+    if today is None:
+        today = datetime.now(timezone.utc).date()
+
+    return [p for p in periods if parse_date(get_period_end(p, granularity)) < today - timedelta(days=1)]
+
+# Function returning a period's label, used as column name in the outputs
+def format_period(period, granularity='monthly'):
+    if granularity == 'monthly':
+        return '%s-%s' % (period[:4], period[4:6])
+
+    return '%s-%s-%s' % (period[:4], period[4:6], period[6:8])
@@ -0,0 +1,93 @@
+# ===============================
+# BHHT Wikipedia API Rate Control
+# ===============================
+#
+# Token bucket shared by every worker. Its rate adapts to the API's answers
+# AIMD-style: it grows additively while responses are healthy and is cut
+# multiplicatively whenever we get throttled or the servers struggle.
+#
+from email.utils import parsedate_to_datetime
+import asyncio
+import random
+import time
+
+# Function parsing a Retry-After header into a number of seconds
+def parse_retry_after(value):
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, date.timestamp() - time.time())
+
+# Function returning the exponential backoff delay for the given attempt
+def backoff_delay(attempt, base=1.0, maximum=300.0, retry_after=None):
+    delay = min(maximum, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+
+    return delay
+
+class RateController(object):
+    def __init__(self, rate=50.0, min_rate=1.0, max_rate=100.0,
+                 increase=1.0, decrease=0.5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.decreased_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self, now):
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    # Waiting until we are allowed to send one more request
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.refill(now)
+
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+    # Additive increase: roughly +increase req/s per second of healthy answers
+    def speed_up(self):
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    # Multiplicative decrease, at most once per congestion episode
+    def slow_down(self, retry_after=None):
+        now = time.monotonic()
+
+        if retry_after is not None:
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+        if now - self.decreased_at < 1.0:
+            return
+
+        self.decreased_at = now
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self.tokens = min(self.tokens, 1.0)
@@ -6,29 +6,55 @@
 # Simple script aiming at hitting the Wikipedia analytics API to gather
 # some data about page visits.
 #
-from pathlib import Path
 from collections import defaultdict
+from numpy.lib.format import open_memmap
+from pathlib import Path
 import asyncio
 import aiohttp
 import aiofiles
 import csv
 import json
-
-import helpers
+import multiprocessing
+import numpy as np
+import os
+import shutil
+import signal
+import sys
+import time
+import zlib
+
+from checkpoint import Checkpoint, FAILED
+from periods import GRANULARITIES, format_period, get_complete_periods, get_period, get_period_end, get_periods
+from ratelimit import RateController, backoff_delay, parse_retry_after
 
 # Parameters
 START_DATE = 20150101
 END_DATE = 20151231
-CHUNK_SIZE = 10
-CONCURRENCY = CHUNK_SIZE
+GRANULARITY = 'monthly'
+UPDATE = False
+CONCURRENCY = 10
+QUEUE_SIZE = CONCURRENCY * 10
+TIMEOUT = 60
+RATE = 50
+MAX_RATE = 100
+MAX_ATTEMPTS = 10
+FLUSH_SIZE = 1 << 20
+FLUSH_INTERVAL = 5
 
 # Constants
 WIKIPEDIA_PAGE_VIEW_URL = 'http://wikimedia.org/api/rest_v1/metrics/pageviews/per-article'
-WIKIPEDIA_PAGE_VIEW_TEMPLATE = '%(url)s/%(lang)s.wikipedia/all-access/user/%(name)s/monthly/%(start_date)s00/%(end_date)s00'
+WIKIPEDIA_PAGE_VIEW_TEMPLATE = '%(url)s/%(lang)s.wikipedia/all-access/user/%(name)s/%(granularity)s/%(start_date)s00/%(end_date)s00'
 
 # State
-COMPUTED_PAGES = set()
+PERIODS = get_periods(START_DATE, END_DATE, GRANULARITY)
 DONE_COUNT = 0
+RETRY_COUNT = 0
+
+# Error raised when a page should be fetched again later
+class RetryLater(Exception):
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.retry_after = retry_after
 
 # Helper used to write a single CSV line (does not need to take edge cases)
 def write_csv_line(rows):
@@ -39,37 +65,231 @@ def write_csv_line(rows):
 def hash_row(row):
     return row['name'] + '§' + row['lang']
 
-# Generator consuming the input file
-def input_file_generator(file_path):
-    with open(file_path, encoding='utf-8') as f:
-        reader = csv.DictReader(f)
+# Function returning the output's header
+def get_header():
+    return ['lang', 'id', 'name'] + [format_period(p, GRANULARITY) for p in PERIODS]
+
+# Function returning the views already known for the given row, i.e. those
+# found in the row when updating a previous output
+def get_known_views(row):
+    if not UPDATE:
+        return {}
+
+    known = {}
+
+    for period in PERIODS:
+        value = row.get(format_period(period, GRANULARITY))
+
+        if value:
+            known[period] = int(value)
+
+    return known
+
+# Generator consuming the input file, starting at the given byte offset and
+# yielding jobs as (start offset, end offset, row number, row) tuples
+def input_file_generator(file_path, offset=0, index=0):
+    with open(file_path, mode='rb') as f:
+        header = f.readline()
+        fieldnames = next(csv.reader([header.decode('utf-8')]))
+        position = max(offset, len(header))
+
+        f.seek(position)
+
+        # Tracking the byte offset of the lines consumed by the CSV reader
+        def lines():
+            nonlocal position
+
+            for line in f:
+                position += len(line)
+                yield line.decode('utf-8')
+
+        reader = csv.reader(lines())
+
+        # When starting from the top, the header is absorbed by the first row
+        start = offset
+
+        for values in reader:
+
+            # Blank lines are absorbed by the next row
+            if not values:
+                continue
+
+            row = dict(zip(fieldnames, values))
+
+            if 'lang' not in row:
+                row['lang'] = 'en'
+
+            yield start, position, index, row
+
+            start = position
+            index += 1
+
+# Function building a checkpoint from an output file written by a version of
+# this script predating checkpoints (costly, but only needed once). Since
+# those versions dropped the rows that errored, rows missing from the output
+# before its last row are recorded as failed, so that the watermark moves past
+# them and they are retried.
+def migrate_legacy_output(output_file_path, input_file_path, checkpoint_path):
+    computed_pages = set()
+
+    with open(output_file_path, encoding='utf-8', mode='r') as f:
+        reader = csv.reader(f)
 
         for row in reader:
-            yield row
 
-# Coroutine used to download one page's data
-async def get_page_stats(session, row):
+            # Skipping header
+            if row[:3] == ['lang', 'id', 'name']:
+                continue
+
+            row = {
+                'name': row[2],
+                'lang': row[0]
+            }
+
+            computed_pages.add(hash_row(row))
+
+    checkpoint = Checkpoint(checkpoint_path)
+    missing = []
+
+    for start, end, index, row in input_file_generator(input_file_path):
+        if hash_row(row) not in computed_pages:
+            missing.append((start, end, index))
+            continue
+
+        for job in missing:
+            checkpoint.add(*job, status=FAILED)
+
+        missing.clear()
+        checkpoint.add(start, end, index)
+
+    checkpoint.flush()
+    checkpoint.close()
+
+# Output appending results as CSV lines, buffered in memory until flushed
+# so that the file is written in large blocks
+class CSVOutput(object):
+    def __init__(self, file):
+        self.file = file
+        self.buffer = []
+        self.buffered = 0
+
+    @classmethod
+    async def open(cls, file_path):
+        is_new = not os.path.exists(file_path) or os.path.getsize(file_path) == 0
+        output = cls(await aiofiles.open(file_path, encoding='utf-8', mode='a+'))
+
+        if is_new:
+            await output.file.write(write_csv_line(get_header()) + '\n')
+
+        return output
+
+    def write(self, index, row, views):
+        csv_line = write_csv_line([
+            row['lang'],
+            row.get('id', ''),
+            row['name']
+        ] + views) + '\n'
+
+        self.buffer.append(csv_line)
+        self.buffered += len(csv_line)
+
+    async def flush(self):
+        if self.buffer:
+            await self.file.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+        await self.file.flush()
+
+    async def close(self):
+        await self.file.close()
+
+# Output storing results in a uint32 matrix memory-mapped from a .npy file,
+# having one row per input row and one column per period. Sidecar files map
+# each matrix row to its page and each column to its period.
+class MatrixOutput(object):
+    def __init__(self, file_path, input_file_path):
+        if not os.path.exists(file_path):
+            self.create(file_path, input_file_path)
+
+        self.matrix = open_memmap(file_path, mode='r+')
+        self.buffered = 0
+
+        if self.matrix.shape[1] != len(PERIODS):
+            raise ValueError('%s has %i columns but %i periods were requested' % (file_path, self.matrix.shape[1], len(PERIODS)))
+
+    @staticmethod
+    def index_path(file_path):
+        return Path(file_path).with_suffix('.index.csv')
+
+    @staticmethod
+    def periods_path(file_path):
+        return Path(file_path).with_suffix('.periods.csv')
+
+    @classmethod
+    def create(cls, file_path, input_file_path):
+        count = 0
+
+        with open(cls.index_path(file_path), 'w', encoding='utf-8') as f:
+            f.write('row,lang,id,name\n')
+
+            for _, _, index, row in input_file_generator(input_file_path):
+                f.write(write_csv_line([index, row['lang'], row.get('id', ''), row['name']]) + '\n')
+                count += 1
+
+        with open(cls.periods_path(file_path), 'w', encoding='utf-8') as f:
+            f.write('column,period\n')
+
+            for column, period in enumerate(PERIODS):
+                f.write('%i,%s\n' % (column, format_period(period, GRANULARITY)))
+
+        open_memmap(file_path, mode='w+', dtype=np.uint32, shape=(count, len(PERIODS))).flush()
+
+    def write(self, index, row, views):
+        self.matrix[index] = views
+        self.buffered += self.matrix.itemsize * len(views)
+
+    async def flush(self):
+        await asyncio.get_event_loop().run_in_executor(None, self.matrix.flush)
+        self.buffered = 0
+
+    async def close(self):
+        await self.flush()
+        del self.matrix
+
+# Coroutine used to download one page's data between the given periods,
+# returning a period -> views dict
+async def get_page_stats(session, rate, row, start_period, end_period):
 
     # Building URL
     url_params = {
         'url': WIKIPEDIA_PAGE_VIEW_URL,
         'lang': row['lang'],
         'name': row['name'],
-        'start_date': START_DATE,
-        'end_date': END_DATE
+        'granularity': GRANULARITY,
+        'start_date': start_period,
+        'end_date': end_period
     }
 
     url = WIKIPEDIA_PAGE_VIEW_TEMPLATE % url_params
+    started_at = time.monotonic()
 
     async with session.get(url) as response:
+        print('Response "%s": HTTP %i in %.1fms' % (row['name'], response.status, (time.monotonic() - started_at) * 1000))
 
-        # Hitting the rate limit
-        if response.status == 429:
-            print('We hit the rate limit!!!')
-            return None
+        # Hitting the rate limit or a struggling server: slowing down
+        if response.status == 429 or response.status >= 500:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            rate.slow_down(retry_after)
+
+            raise RetryLater('HTTP %i' % response.status, retry_after)
 
-        if response.status >= 500:
-            print('Server error from wikipedia!!!')
+        rate.speed_up()
+
+        # Other client errors, e.g. an invalid range, are failures, but for
+        # missing pages, which have no views
+        if 400 <= response.status < 500 and response.status != 404:
+            print('Error', 'HTTP %i' % response.status, url)
             return None
 
         # Reading response
@@ -82,69 +302,330 @@ async def get_page_stats(session, row):
             data = json.loads(text)
             items = data['items'] if 'items' in data else []
 
-            # Filling empty months data
-            monthsIndex = defaultdict(int)
+            # Filling empty periods data
+            views = defaultdict(int)
 
             for item in items:
-                monthsIndex[int(item['timestamp'][4:6])] = item['views']
+                views[get_period(item['timestamp'], GRANULARITY)] = item['views']
 
         except Exception as e:
             print('Error', e, url)
             return None
 
-        return [monthsIndex[month] for month in range(1, 13)]
+        return views
+
+# Coroutine fetching the views of one page for the periods not already known
+async def get_page_views(session, rate, row):
+    views = get_known_views(row)
+    missing = [period for period in PERIODS if period not in views]
+
+    if missing:
+        await rate.acquire()
+
+        # NOTE: the API only returns complete months, up to the end date
+        end_period = get_period_end(missing[-1], GRANULARITY)
+
+        fetched = await get_page_stats(session, rate, row, missing[0], end_period)
+
+        if fetched is None:
+            return None
+
+        for period in missing:
+            views[period] = fetched[period]
+
+    return [views[period] for period in PERIODS]
 
-# Function used to process one single page
-async def process_page(session, semaphore, output, row):
+# Coroutine reading the input file and feeding the jobs queue
+async def produce(input_file_path, checkpoint, jobs):
+
+    # Retrying rows which failed during previous runs
+    for start, (_, index) in sorted(checkpoint.failed.items()):
+        job = next(input_file_generator(input_file_path, start, index))
+        await jobs.put((job, 0))
+
+    # Resuming right where we stopped
+    for job in input_file_generator(input_file_path, checkpoint.offset, checkpoint.row):
+
+        # Skip if already done
+        if job[0] in checkpoint:
+            continue
+
+        await jobs.put((job, 0))
+
+# Coroutine putting a failed page back in the jobs queue after some delay.
+# The failed job is only marked as done once requeued so that the jobs queue
+# cannot be considered drained while some retries are still pending.
+async def retry(jobs, job, attempt, delay):
+    await asyncio.sleep(delay)
+    await jobs.put((job, attempt))
+    jobs.task_done()
+
+# Coroutine fetching pages from the jobs queue, forever
+async def work(session, rate, jobs, results, retries):
+    global RETRY_COUNT
+
+    while True:
+        job, attempt = await jobs.get()
+        row = job[3]
+
+        print('(%i) Processing "%s"...' % (DONE_COUNT, row['name']))
+
+        # Fetching data from API
+        try:
+            views = await get_page_views(session, rate, row)
+        except (RetryLater, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            retry_after = getattr(e, 'retry_after', None)
+
+            if not isinstance(e, RetryLater):
+                rate.slow_down()
+
+            if attempt + 1 >= MAX_ATTEMPTS:
+                print('Giving up', row['name'], e)
+                await results.put((job, None))
+                jobs.task_done()
+                continue
+
+            RETRY_COUNT += 1
+            delay = backoff_delay(attempt, retry_after=retry_after)
+            print('Retrying "%s" in %.1fs (%s)' % (row['name'], delay, str(e) or type(e).__name__))
+
+            task = asyncio.ensure_future(retry(jobs, job, attempt + 1, delay))
+            retries.add(task)
+            task.add_done_callback(retries.discard)
+            continue
+
+        # Any other error, e.g. a malformed row, fails the page for this run,
+        # the job being marked as done so that the jobs queue can be drained
+        except Exception as e:
+            print('Error', row['name'], e)
+            await results.put((job, None))
+            jobs.task_done()
+            continue
+
+        await results.put((job, views))
+        jobs.task_done()
+
+# Coroutine writing results as they arrive. Results are buffered by the output
+# and flushed in blocks, every FLUSH_SIZE bytes or FLUSH_INTERVAL seconds. The
+# checkpoint is only flushed after the output so that it never records rows
+# missing from the output.
+async def write(output, checkpoint, results):
     global DONE_COUNT
 
-    print('(%i) Processing "%s"...' % (DONE_COUNT, row['name']))
+    loop = asyncio.get_event_loop()
+    flushed_at = loop.time()
+    done = False
 
-    # Fetching data from API
-    async with semaphore:
-        months = await get_page_stats(session, row)
+    while not done:
+        timeout = max(0, flushed_at + FLUSH_INTERVAL - loop.time())
 
-    if months:
-        DONE_COUNT += 1
+        # Waiting for results, then taking every one already there at once
+        try:
+            items = [await asyncio.wait_for(results.get(), timeout)]
+        except asyncio.TimeoutError:
+            items = []
 
-        # Writing result as CSV
-        csv_line = write_csv_line([
-            row['lang'],
-            row.get('id', ''),
-            row['name']
-        ] + months)
+        while not results.empty():
+            items.append(results.get_nowait())
+
+        for item in items:
+            if item is None:
+                done = True
+                break
+
+            (start, end, index, row), views = item
 
-        await output.write(csv_line + '\n')
+            if views:
+                DONE_COUNT += 1
+
+                output.write(index, row, views)
+                checkpoint.add(start, end, index)
+            else:
+                checkpoint.add(start, end, index, FAILED)
+
+        if output.buffered >= FLUSH_SIZE or loop.time() - flushed_at >= FLUSH_INTERVAL:
+            await output.flush()
+            checkpoint.flush()
+            flushed_at = loop.time()
+
+    await output.flush()
+    checkpoint.flush()
 
 # Main loop
-async def main(loop, output_file_path, input_file_path):
-    input_file = input_file_generator(input_file_path)
-    semaphore = asyncio.Semaphore(CONCURRENCY)
+async def main(loop, output_file_path, input_file_path, checkpoint, output_format='csv'):
+    jobs = asyncio.Queue(QUEUE_SIZE)
+    results = asyncio.Queue(QUEUE_SIZE)
+
+    rate = RateController(rate=RATE, max_rate=MAX_RATE)
+    connector = aiohttp.TCPConnector(limit=CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+
+    if output_format == 'npy':
+        output = MatrixOutput(output_file_path, input_file_path)
+    else:
+        output = await CSVOutput.open(output_file_path)
+
+    async with aiohttp.ClientSession(loop=loop, connector=connector, timeout=timeout) as session:
+
+        writer = asyncio.ensure_future(write(output, checkpoint, results))
+        retries = set()
+
+        workers = [
+            asyncio.ensure_future(work(session, rate, jobs, results, retries))
+            for _ in range(CONCURRENCY)
+        ]
+
+        async def fetch():
+            await produce(input_file_path, checkpoint, jobs)
+            await jobs.join()
+
+        fetcher = asyncio.ensure_future(fetch())
+        interrupted = False
+
+        # On SIGINT/SIGTERM, we stop fetching but still flush what was fetched
+        # so that the next run can resume from there. Interrupting twice kills.
+        def interrupt():
+            nonlocal interrupted
+
+            print('Interrupted, flushing results...')
+            interrupted = True
+
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+
+            fetcher.cancel()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, interrupt)
+
+        try:
+            await fetcher
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+
+            for task in workers + list(retries):
+                task.cancel()
 
-    async with aiofiles.open(output_file_path, encoding='utf-8', mode='a+') as o,\
-               aiohttp.ClientSession(loop=loop) as session:
+        await results.put(None)
+        await writer
 
-        chunk = helpers.consume(input_file, CHUNK_SIZE)
+    await output.close()
 
-        while len(chunk):
+    return not interrupted
 
-            tasks = []
-            for row in chunk:
+# Function running the whole process on a single input file, returning whether
+# every row was processed
+def run(input_file_path, output_file_path, checkpoint_path, output_format='csv'):
+    global DONE_COUNT
+
+    # Checking which part we already did
+    has_output = os.path.exists(output_file_path) and os.path.getsize(output_file_path) > 0
+
+    if output_format == 'csv' and has_output and not os.path.exists(checkpoint_path):
+        print('Building checkpoint from existing output...')
+        migrate_legacy_output(output_file_path, input_file_path, checkpoint_path)
+
+    checkpoint = Checkpoint(checkpoint_path)
+    DONE_COUNT = len(checkpoint)
+
+    print('Already done %i pages.' % DONE_COUNT)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    try:
+        return loop.run_until_complete(main(loop, output_file_path, input_file_path, checkpoint, output_format))
+    finally:
+        checkpoint.close()
+        loop.close()
+
+# Function returning the shard of the given row
+def get_shard(row, shards):
+    return zlib.crc32(hash_row(row).encode('utf-8')) % shards
+
+# Function splitting the input file into one file per shard. Files are only
+# renamed once complete so that an interrupted split is simply done again.
+def split_input(input_file_path, shard_input_paths):
+    if all(os.path.exists(path) for path in shard_input_paths):
+        return
+
+    with open(input_file_path, encoding='utf-8') as f:
+        fieldnames = next(csv.reader(f))
+
+    files = [open(path + '.tmp', 'w', encoding='utf-8', newline='') for path in shard_input_paths]
+    writers = [csv.writer(f) for f in files]
+
+    for writer in writers:
+        writer.writerow(fieldnames)
+
+    for _, _, _, row in input_file_generator(input_file_path):
+        writer = writers[get_shard(row, len(writers))]
+        writer.writerow([row.get(k, '') for k in fieldnames])
+
+    for f, path in zip(files, shard_input_paths):
+        f.close()
+        os.replace(path + '.tmp', path)
+
+# Function concatenating the shards' CSV outputs, keeping a single header
+def merge_outputs(shard_output_paths, output_file_path):
+    with open(output_file_path, 'w', encoding='utf-8') as o:
+        for i, path in enumerate(shard_output_paths):
+            with open(path, encoding='utf-8') as f:
+                header = f.readline()
+
+                if i == 0:
+                    o.write(header)
+
+                shutil.copyfileobj(f, o)
 
-                if 'lang' not in row:
-                    row['lang'] = 'en'
+# Function running the process on N shards of the input, split by hash of the
+# pages, each shard in its own process with its own event loop, output and
+# checkpoint, before merging their outputs. The request rate is shared among
+# the shards so that we don't hit the API harder than a single process would.
+def run_shards(input_file_path, output_file_path, shards):
+    global RATE, MAX_RATE
 
-                # Skip if already done
-                if hash_row(row) in COMPUTED_PAGES:
-                    continue
+    directory = output_file_path + '.shards'
+    os.makedirs(directory, exist_ok=True)
 
-                tasks.append(process_page(session, semaphore, o, row))
+    shard_input_paths = [os.path.join(directory, 'input-%i.csv' % i) for i in range(shards)]
+    shard_output_paths = [os.path.join(directory, 'output-%i.csv' % i) for i in range(shards)]
 
-            if tasks:
-                await asyncio.wait(tasks)
+    print('Splitting input into %i shards...' % shards)
+    split_input(input_file_path, shard_input_paths)
 
-            # Next chunk
-            chunk = helpers.consume(input_file, CHUNK_SIZE)
+    RATE /= shards
+    MAX_RATE /= shards
+
+    def run_shard(i):
+        completed = run(shard_input_paths[i], shard_output_paths[i], shard_output_paths[i] + '.checkpoint')
+        sys.exit(0 if completed else 1)
+
+    # Shards are forked so that they inherit the parameters
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=run_shard, args=(i,)) for i in range(shards)]
+
+    for process in processes:
+        process.start()
+
+    # Shards handle interruptions themselves
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    for process in processes:
+        process.join()
+
+    if any(process.exitcode != 0 for process in processes):
+        print('Some shards did not complete, run again to resume them.')
+        return False
+
+    print('Merging shards...')
+    merge_outputs(shard_output_paths, output_file_path)
+
+    return True
 
 # Launching process if script is invoked as main
 if __name__ == '__main__':
@@ -154,26 +635,46 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('input', help='Path to the input file.')
     parser.add_argument('output', help='Path to the output file.')
+    parser.add_argument('--start', default=START_DATE, help='First day of the periods to gather, as YYYYMMDD. Defaults to %(default)s.')
+    parser.add_argument('--end', default=END_DATE, help='Last day of the periods to gather, as YYYYMMDD. Defaults to %(default)s.')
+    parser.add_argument('--granularity', choices=GRANULARITIES, default=GRANULARITY, help='Defaults to %(default)s.')
+    parser.add_argument('--update', action='store_true', help='Whether the input is a previous CSV output that should be completed by only fetching its missing periods.')
+    parser.add_argument('--format', choices=['csv', 'npy'], default='csv', help='Output format. "npy" writes a uint32 matrix along with a ".index.csv" sidecar file.')
+    parser.add_argument('--checkpoint', help='Path to the checkpoint file. Defaults to the output path suffixed with ".checkpoint".')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='Number of concurrent requests. Defaults to %(default)s.')
+    parser.add_argument('--rate', type=float, default=RATE, help='Initial number of requests per second. Defaults to %(default)s.')
+    parser.add_argument('--max-rate', type=float, default=MAX_RATE, help='Maximum number of requests per second. Defaults to %(default)s.')
+    parser.add_argument('--url', default=WIKIPEDIA_PAGE_VIEW_URL, help='Base url of the pageviews API, useful to run against a local stub.')
+    parser.add_argument('--shards', type=int, default=1, help='Number of processes among which to split the input. Shards are kept in a directory named after the output, suffixed with ".shards".')
     args = parser.parse_args()
 
-    # Touching result file
-    Path(args.output).touch()
+    if args.shards > 1 and (args.format != 'csv' or args.checkpoint):
+        parser.error('--shards only works with the csv format and default checkpoints.')
 
-    # Checking which part we already did
-    with open(args.output, encoding='utf-8', mode='r') as f:
-        reader = csv.reader(f)
+    CONCURRENCY = args.concurrency
+    QUEUE_SIZE = CONCURRENCY * 10
+    RATE = args.rate
+    MAX_RATE = args.max_rate
+    WIKIPEDIA_PAGE_VIEW_URL = args.url.rstrip('/')
 
-        for row in reader:
-            row = {
-                'name': row[2],
-                'lang': row[0]
-            }
+    GRANULARITY = args.granularity
+    UPDATE = args.update
 
-            COMPUTED_PAGES.add(hash_row(row))
+    # NOTE: periods that are not over yet would be written as 0 views, and
+    # never fetched again when updating, so they are left for a later run
+    requested = get_periods(args.start, args.end, args.granularity)
+    PERIODS = get_complete_periods(requested, GRANULARITY)
 
-    DONE_COUNT = len(COMPUTED_PAGES)
+    if not PERIODS:
+        parser.error('None of the requested periods is complete yet.')
 
-    print('Already done %i pages.' % DONE_COUNT)
+    if len(PERIODS) < len(requested):
+        print('Skipping %i periods from %s, which are not complete yet' % (len(requested) - len(PERIODS), format_period(requested[len(PERIODS)], GRANULARITY)))
 
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main(loop, args.output, args.input))
+    if args.shards > 1:
+        completed = run_shards(args.input, args.output, args.shards)
+    else:
+        checkpoint_path = args.checkpoint or args.output + '.checkpoint'
+        completed = run(args.input, args.output, checkpoint_path, args.format)
+
+    sys.exit(0 if completed else 1)